@@ -0,0 +1,72 @@
+"""Generates a synthetic household (tasks.yaml, users.yaml) and years of scheduled tasks history, to benchmark the server"""
+from datetime import date, timedelta
+import random
+import sqlite3
+import yaml
+
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+STATUS_WEIGHTS = {"completed": 0.8, "incomplete": 0.2}
+
+def generate_tasks(task_count: int, rng: random.Random) -> list[dict]:
+    tasks = []
+    for task_id in range(1, task_count + 1):
+        task = {
+            "id": task_id,
+            "name": f"Task {task_id}",
+            "days_interval": rng.choice([1, 2, 3, 3, 4, 7, 7, 14, 30]),
+            "effort": rng.choice([0, 1, 1, 1, 2, 2, 3]),
+        }
+        if rng.random() < 0.3:
+            task["allowed_days"] = sorted(rng.sample(DAY_NAMES, rng.randint(1, 6)), key=DAY_NAMES.index)
+        tasks.append(task)
+    return tasks
+
+def generate_users(user_count: int, rng: random.Random) -> list[dict]:
+    return [{"id": user_id, "username": f"User {user_id}", "available_daily_effort": {day_name: rng.randint(2, 8) for day_name in DAY_NAMES}}
+            for user_id in range(1, user_count + 1)]
+
+def generate_history(tasks: list[dict], users: list[dict], days: int, until: date, rng: random.Random):
+    """Yields (task_id, user_id, scheduled_date ordinal, status) rows, following each task interval and allowed days"""
+    first_day = until - timedelta(days=days)
+    next_due_by_task = {task["id"]: first_day.toordinal() + rng.randint(0, task["days_interval"]) for task in tasks}
+    for ordinal in range(first_day.toordinal(), until.toordinal()):
+        day_name = DAY_NAMES[date.fromordinal(ordinal).weekday()]
+        for task in tasks:
+            if next_due_by_task[task["id"]] > ordinal:
+                continue
+            if "allowed_days" in task and day_name not in task["allowed_days"]:
+                continue
+            next_due_by_task[task["id"]] = ordinal + task["days_interval"]
+            status = rng.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()))[0]
+            yield (task["id"], rng.choice(users)["id"], ordinal, status)
+
+def write_household(base_path: str, task_count: int, user_count: int, history_days: int, seed: int = 0) -> dict:
+    """Writes the config files and a migrated database with the history on base_path. Returns a summary of what was generated"""
+    # Imported here, so the caller can point HOME_TASK_SCHEDULER_PATH to base_path before the server modules are loaded
+    from repositories.database_client import init_db, get_database_path
+    from repositories.scheduled_task_stats_repository import ScheduledTaskStatsRepository
+
+    rng = random.Random(seed)
+    tasks = generate_tasks(task_count, rng)
+    users = generate_users(user_count, rng)
+    with open(base_path + "tasks.yaml", "w", encoding="utf-8") as file:
+        yaml.safe_dump(tasks, file, sort_keys=False)
+    with open(base_path + "users.yaml", "w", encoding="utf-8") as file:
+        yaml.safe_dump(users, file, sort_keys=False)
+
+    init_db()
+    con = sqlite3.connect(get_database_path())
+    try:
+        rows = generate_history(tasks, users, history_days, date.today(), rng)
+        con.executemany("INSERT INTO scheduled_tasks (task_id, user_id, scheduled_date, status) VALUES (?, ?, ?, ?)", rows)
+        # The generated history bypasses the repository, so the derived tables are rebuilt from it
+        con.execute("DELETE FROM task_schedule_state")
+        con.execute("INSERT INTO task_schedule_state (task_id, last_scheduled_date) SELECT task_id, MAX(scheduled_date) FROM scheduled_tasks GROUP BY task_id")
+        ScheduledTaskStatsRepository().rebuild(con)
+        # The history ends yesterday, as if the add-on had generated every day until then
+        con.execute("INSERT OR REPLACE INTO generation_state (id, last_generated_date) VALUES (1, ?)", [date.today().toordinal() - 1])
+        con.commit()
+        history_rows = con.execute("SELECT COUNT(*) FROM scheduled_tasks").fetchone()[0]
+    finally:
+        con.close()
+    return {"tasks": task_count, "users": user_count, "history_days": history_days, "history_rows": history_rows, "seed": seed}
@@ -0,0 +1,201 @@
+"""Benchmarks the server against a synthetic household, in process and without opening any port.
+
+Usage (from the add-on folder):
+    python3 benchmarks/run_benchmarks.py --tasks 300 --users 6 --years 3 --output results.json
+
+The results are JSON, with the latency, number of SQL statements and peak memory of each scenario,
+so they can be compared between versions.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+SERVER_PATH = os.path.join(BENCHMARKS_PATH, "..", "rootfs", "usr", "bin", "server")
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+def call_route(app, method: str, path: str, body=None):
+    """Runs a request through the WSGI app, as waitress would. Returns the status code"""
+    from wsgiref.util import setup_testing_defaults
+    path, _, query_string = path.partition("?")
+    data = json.dumps(body).encode() if body != None else b""
+    environ = {"REQUEST_METHOD": method, "PATH_INFO": path, "QUERY_STRING": query_string,
+               "CONTENT_TYPE": "application/json", "CONTENT_LENGTH": str(len(data)), "wsgi.input": io.BytesIO(data)}
+    setup_testing_defaults(environ)
+    status = []
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split(" ")[0]))
+    result = app(environ, start_response)
+    for _ in result: # Consume the body, as streamed responses do their work while being iterated
+        pass
+    if hasattr(result, "close"):
+        result.close()
+    return status[0]
+
+def measure(name: str, run, repeat: int, before_each=None) -> dict:
+    from repositories.database_client import open_db_session
+    from services.write_queue_service import WriteQueueService
+    counter = StatementCounter()
+    # Writes run on the writer thread, on its own connection. Setting the callback there changes nothing, so it doesn't invalidate the caches
+    writeQueueService = WriteQueueService()
+    open_db_session().set_trace_callback(counter)
+    writeQueueService.run(lambda con: con.set_trace_callback(counter), changes_schedule=False)
+    counter.count = 0 # The end of the transaction that set it on the writer is not part of the scenario
+    durations = []
+    try:
+        for _ in range(repeat):
+            if before_each != None:
+                # Its statements are not part of the scenario
+                statements_before = counter.count
+                before_each()
+                counter.count = statements_before
+            start = time.perf_counter()
+            run()
+            durations.append((time.perf_counter() - start) * 1000)
+        statements = counter.count
+
+        # Memory is measured on a separate run, as tracing allocations slows everything down
+        if before_each != None:
+            before_each()
+        tracemalloc.start()
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        open_db_session().set_trace_callback(None)
+        writeQueueService.run(lambda con: con.set_trace_callback(None), changes_schedule=False)
+
+    durations.sort()
+    return {
+        "name": name,
+        "repeat": repeat,
+        "mean_ms": round(statistics.mean(durations), 3),
+        "p50_ms": round(durations[len(durations) // 2], 3),
+        "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3),
+        "max_ms": round(durations[-1], 3),
+        "sql_statements_per_run": round(statements / repeat, 1),
+        "peak_memory_kib": round(peak_memory / 1024, 1),
+    }
+
+def route_scenario(app, method: str, path: str, body=None):
+    def run():
+        status = call_route(app, method, path, body)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} answered {status}")
+    return run
+
+def run_benchmarks(args) -> dict:
+    from data_generator import write_household
+    household = write_household(os.environ["HOME_TASK_SCHEDULER_PATH"], args.tasks, args.users, args.years * 365, args.seed)
+
+    import controller
+    from services.generate_tasks_service import GenerateTasksService
+    from services.notifications_service import NotificationService
+    from services.schedule_changes_service import ScheduleChangesService
+    from services.task_assignment_service import AssignmentStrategy
+    from services.write_queue_service import WriteQueueService
+    from repositories.database_client import open_db_session
+    scheduleChangesService = ScheduleChangesService()
+    generateTasksService = GenerateTasksService(AssignmentStrategy(args.strategy), args.seed)
+    notificationService = NotificationService()
+    writeQueueService = WriteQueueService()
+    app = controller.app
+    # The database was already prepared, so the server startup (which also generates tasks) is skipped
+    controller.startupFinished.set()
+
+    scenarios = []
+    scenarios.append(measure("generate_daily_tasks", generateTasksService.generate_daily_tasks, args.generation_repeat))
+    def invalidate_caches():
+        # An empty write that changes the schedule, so the today cache is loaded again too, not only the notification
+        writeQueueService.run(lambda con: None)
+        scheduleChangesService.mark_schedule_changed()
+    scenarios.append(measure("get_notification_message (cold)", lambda: notificationService.get_notification_message("en"), args.repeat,
+                             before_each=invalidate_caches))
+    scenarios.append(measure("get_notification_message (cached)", lambda: notificationService.get_notification_message("en"), args.repeat))
+
+    with open_db_session() as con:
+        scheduled_task_id = con.execute("SELECT MAX(scheduled_task_id) FROM scheduled_tasks").fetchone()[0]
+    routes = [
+        ("GET", "/tasks", None),
+        ("GET", "/tasks/1", None),
+        ("GET", "/scheduled-tasks/today", None),
+        ("GET", "/scheduled-tasks/today?status=pending", None),
+        ("GET", f"/scheduled-tasks/{scheduled_task_id}", None),
+        ("GET", "/users/1/pending-tasks", None),
+        ("GET", "/notifications/scheduled-tasks?language=en", None),
+        ("GET", "/scheduled-tasks/forecast?days=30", None),
+        ("GET", "/scheduled-tasks?limit=10000", None),
+        ("GET", "/scheduled-tasks?user_id=1&limit=100", None),
+        ("GET", "/statistics", None),
+        ("GET", "/scheduled-tasks/export?format=ndjson", None),
+        ("GET", "/scheduled-tasks/export?format=csv", None),
+        ("GET", "/events?since={cursor}&timeout=0", None),
+        ("PUT", f"/scheduled-tasks/{scheduled_task_id}", {"status": "pending"}),
+        ("PUT", "/scheduled-tasks", {"tasks": [{"scheduled_task_id": scheduled_task_id - offset, "status": "completed"} for offset in range(20)]}),
+        ("PUT", "/users/1/pending-tasks", {"status": "completed"}),
+        ("POST", "/generate-tasks", None),
+    ]
+    for method, path, body in routes:
+        repeat = args.generation_repeat if path == "/generate-tasks" else args.repeat
+        request_path = path.replace("{cursor}", scheduleChangesService.get_schedule_validator())
+        scenarios.append(measure(f"{method} {path}", route_scenario(app, method, request_path, body), repeat))
+
+    return {
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform(), "machine": platform.machine()},
+        "household": household,
+        "strategy": args.strategy,
+        "scenarios": scenarios,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the home task scheduler server with a synthetic household")
+    parser.add_argument("--tasks", type=int, default=200, help="Number of tasks on tasks.yaml")
+    parser.add_argument("--users", type=int, default=4, help="Number of users on users.yaml")
+    parser.add_argument("--years", type=int, default=3, help="Years of scheduled tasks history")
+    parser.add_argument("--repeat", type=int, default=50, help="Runs of each request scenario")
+    parser.add_argument("--generation-repeat", type=int, default=5, help="Runs of each task generation scenario")
+    parser.add_argument("--strategy", default="least_loaded", help="Task assignment strategy used by the generation scenario")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and the task shuffling")
+    parser.add_argument("--output", help="File to write the JSON results to (stdout if not given)")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the generated config and database files")
+    args = parser.parse_args()
+
+    # The server modules read the base path when imported, so it is set before loading any of them
+    data_path = tempfile.mkdtemp(prefix="home-task-scheduler-benchmark-") + "/"
+    os.environ["HOME_TASK_SCHEDULER_PATH"] = data_path
+    sys.path.insert(0, SERVER_PATH)
+    sys.path.insert(0, BENCHMARKS_PATH)
+    logging.disable(logging.WARNING) # Generation logs every assignment
+
+    try:
+        results = run_benchmarks(args)
+    finally:
+        if args.keep_data:
+            print(f"Generated data kept on {data_path}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_path, ignore_errors=True)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
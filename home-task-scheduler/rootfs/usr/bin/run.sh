@@ -1,4 +1,14 @@
-#!/bin/sh
+#!/usr/bin/with-contenv bashio
+
+# Add-on options, set on the add-on configuration page
+if bashio::config.has_value 'push_url'; then
+    export HOME_TASK_SCHEDULER_PUSH_URL="$(bashio::config 'push_url')"
+fi
+if bashio::config.has_value 'push_token'; then
+    export HOME_TASK_SCHEDULER_PUSH_TOKEN="$(bashio::config 'push_token')"
+fi
+export HOME_TASK_SCHEDULER_PUSH_LANGUAGE="$(bashio::config 'push_language' 'en')"
+export HOME_TASK_SCHEDULER_RETENTION_DAYS="$(bashio::config 'history_retention_days' '0')"
 
 echo "Starting server.."
 
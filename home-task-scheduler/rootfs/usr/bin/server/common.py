@@ -1,3 +1,13 @@
+import os
 
-# Path in where the configuration and database files will live
-BASE_TARGET_PATH = "/config/home-task-scheduler/"
\ No newline at end of file
+# Path in where the configuration and database files will live, ending with "/" (can be overridden, for example to run benchmarks)
+BASE_TARGET_PATH = os.environ.get("HOME_TASK_SCHEDULER_PATH", "/config/home-task-scheduler/")
+
+# Days of scheduled tasks history kept as is, older ones are only kept as daily aggregates. Zero or less (the default) keeps everything
+HISTORY_RETENTION_DAYS = int(os.environ.get("HOME_TASK_SCHEDULER_RETENTION_DAYS", "0"))
+
+# Home Assistant webhook (or any HTTP endpoint) to which the notifications are pushed when the schedule changes. Empty disables it
+PUSH_URL = os.environ.get("HOME_TASK_SCHEDULER_PUSH_URL", "")
+# Optional long-lived access token, needed when pushing to the Home Assistant REST API instead of a webhook
+PUSH_TOKEN = os.environ.get("HOME_TASK_SCHEDULER_PUSH_TOKEN", "")
+PUSH_LANGUAGE = os.environ.get("HOME_TASK_SCHEDULER_PUSH_LANGUAGE", "en")
@@ -1,57 +1,360 @@
-from bottle import Bottle, route, run, request, response, HTTPError
+from bottle import Bottle, route, run, request, response, HTTPError, HTTPResponse, parse_date, http_date
 from services.config_loader_service import ConfigLoaderService
 from domain import TaskStatus
-from model_mapper import scheduledTask_to_model, task_to_model
-from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import date, datetime
+import csv
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from model_mapper import scheduledTask_to_model, scheduledTasks_to_json_list, scheduledTask_to_json, task_to_model
 from services.notifications_service import NotificationService
 from services.generate_tasks_service import GenerateTasksService
-from waitress import serve
+from services.schedule_changes_service import ScheduleChangesService
+from services.forecast_service import ForecastService
+from services.metrics_service import MetricsService
+from services.history_retention_service import HistoryRetentionService
+from services.statistics_service import StatisticsService
+from services.write_queue_service import WriteQueueService
+from services.push_service import PushService
+from services.today_schedule_service import TodayScheduleService
+from services.history_transfer_service import HistoryTransferService, TRANSFER_FORMATS
 from repositories.scheduled_task_repository import ScheduledTaskRepository
 from repositories.database_client import open_db_session, init_db
+from household_context import get_households, get_household, get_current_household, use_household, DEFAULT_HOUSEHOLD_NAME
+
+logger = logging.getLogger(__name__)
 
 app = Bottle()
-scheduler = BackgroundScheduler()
+scheduler = None # Created on start, APScheduler is slow to import
 scheduledTaskRepository = ScheduledTaskRepository()
 generateTasksService = GenerateTasksService()
 notificationService = NotificationService()
 configLoaderService = ConfigLoaderService()
+scheduleChangesService = ScheduleChangesService()
+forecastService = ForecastService()
+metricsService = MetricsService()
+historyRetentionService = HistoryRetentionService()
+statisticsService = StatisticsService()
+writeQueueService = WriteQueueService()
+pushService = PushService()
+todayScheduleService = TodayScheduleService()
+historyTransferService = HistoryTransferService()
+
+# Every event subscriber holds a server thread while connected, so they are limited
+MAX_EVENT_SUBSCRIBERS = 4
+SERVER_THREADS = 4 + MAX_EVENT_SUBSCRIBERS
+EVENTS_KEEP_ALIVE_SECONDS = 15
+EVENTS_STREAM_SECONDS = 300 # Streams are closed periodically, browsers and Home Assistant reconnect with the last event id
+EVENTS_MAX_POLL_SECONDS = 60
+HISTORY_PAGE_SIZE = 500
+MAX_HISTORY_PAGE_SIZE = 10000
+HISTORY_CHUNK_SIZE = 200 # Tasks written on each chunk of a streamed history page
+HOUSEHOLDS_PATH_PREFIX = "/households/"
+TRANSFER_CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+eventSubscribers = threading.BoundedSemaphore(MAX_EVENT_SUBSCRIBERS)
+
+# The startup (migrations and first generation) runs on a background thread, while the server already answers.
+# Until it finishes every route, except the ones below, answers 503
+startupFinished = threading.Event()
+startupError = None
+# Households that failed to start, by name, with the error. Only their routes answer 503, the other ones keep working
+failedHouseholds = {}
+ALWAYS_AVAILABLE_ROUTES = {"/health", "/ready", "/metrics"}
+STARTING_RETRY_AFTER_SECONDS = 5
+
+class RequestMetricsPlugin:
+    """Reports the time spent on every request to the metrics, by route"""
+    name = "request_metrics"
+    api = 2
+
+    def apply(self, callback, route):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                status = result.status_code if isinstance(result, HTTPResponse) else response.status_code
+                return result
+            except HTTPResponse as error:
+                status = error.status_code
+                raise
+            finally:
+                metricsService.observe_request(route.method, route.rule, status, time.perf_counter() - start)
+        return wrapper
+
+class ReadinessPlugin:
+    """Answers 503 on the routes that need the database until the startup has finished"""
+    name = "readiness"
+    api = 2
+
+    def apply(self, callback, route):
+        if route.rule in ALWAYS_AVAILABLE_ROUTES:
+            return callback
+        def wrapper(*args, **kwargs):
+            if not startupFinished.is_set():
+                return HTTPError(503, "The server is starting", **{"Retry-After": str(STARTING_RETRY_AFTER_SECONDS)})
+            if startupError != None:
+                return HTTPError(503, f"The server failed to start: {startupError}")
+            household_error = failedHouseholds.get(get_current_household().name)
+            if household_error != None:
+                return HTTPError(503, f"The household failed to start: {household_error}")
+            return callback(*args, **kwargs)
+        return wrapper
+
+app.install(RequestMetricsPlugin())
+app.install(ReadinessPlugin()) # Installed last so it runs inside the metrics plugin, and 503 answers are measured
+
+def households_app(environ, start_response):
+    """Serves the routes of each household under /households/<name>/, and the ones of the default household without prefix"""
+    path = environ.get("PATH_INFO", "")
+    if not path.startswith(HOUSEHOLDS_PATH_PREFIX):
+        return run_app_in_household(get_household(DEFAULT_HOUSEHOLD_NAME), environ, start_response)
+    household_name, _, path = path[len(HOUSEHOLDS_PATH_PREFIX):].partition("/")
+    household = get_household(household_name)
+    if household == None:
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Household not found"]
+    environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + HOUSEHOLDS_PATH_PREFIX + household_name
+    environ["PATH_INFO"] = "/" + path
+    return run_app_in_household(household, environ, start_response)
+
+def run_app_in_household(household, environ, start_response):
+    # A generator, so the household is also set while streamed responses are being written
+    with use_household(household):
+        result = app(environ, start_response)
+        try:
+            yield from result
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+def run_in_household(household_name: str, function, *args):
+    """Runs a scheduled job for a household"""
+    with use_household(get_household(household_name)):
+        return function(*args)
+
+def run_generation(trigger: str):
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        generateTasksService.generate_daily_tasks()
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        metricsService.observe_generation_run(trigger, outcome, time.perf_counter() - start, time.time())
+
+def start_in_background():
+    def run_startup():
+        global startupError
+        try:
+            on_start()
+            logger.info("Startup finished, the server is ready")
+        except Exception as error:
+            logger.exception("Startup failed")
+            startupError = str(error)
+        finally:
+            startupFinished.set()
+    threading.Thread(target=run_startup, name="startup", daemon=True).start()
 
 def on_start():
-    # Create the config dirs and init the database
-    configLoaderService.create_config_dir()
-    init_db()
-    
-    # Generate the daily tasks and schedule it for a fixed time
-    generateTasksService.generate_daily_tasks()
-    scheduler.add_job(generateTasksService.generate_daily_tasks, trigger="cron", hour=6)
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler()
+    pushService.configure()
+    for household_name in get_households():
+        with use_household(get_household(household_name)):
+            # A household without config dir or database can't serve anything, but it doesn't stop the other ones
+            try:
+                configLoaderService.create_config_dir()
+                init_db()
+            except Exception as error:
+                logger.exception(f"Startup of household {household_name} failed")
+                failedHouseholds[household_name] = str(error)
+                continue
+            # Before the generation, so it gets pushed too
+            pushService.start(get_household(household_name))
+
+            # Generate the daily tasks and schedule it for a fixed time. A failed generation (like a typo on the config files)
+            # is only logged: the household keeps being served, and the next scheduled generation runs with the fixed files
+            try:
+                run_generation("startup")
+            except Exception:
+                logger.exception(f"Startup generation of household {household_name} failed")
+        scheduler.add_job(run_in_household, args=[household_name, run_generation, "schedule"], trigger="cron", hour=6)
+        # Old history is rolled up once a day, after the generation
+        scheduler.add_job(run_in_household, args=[household_name, historyRetentionService.apply_retention], trigger="cron", hour=6, minute=30)
     scheduler.start()
 
+def conditional_get(validator: tuple, last_modified: float, build_body):
+    """Answer 304 if the client already has the content identified by the validator, otherwise build it"""
+    etag = '"' + hashlib.sha1(repr(validator).encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    # Dates only have whole seconds, so another change on the same second would get the same date and a stale 304.
+    # The date is only given (and If-Modified-Since honoured) once the second of the last change has passed, until then the ETag does it
+    last_modified_is_final = int(last_modified) < int(time.time())
+    if last_modified_is_final:
+        headers["Last-Modified"] = http_date(last_modified)
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match != None:
+        # If-None-Match takes precedence over If-Modified-Since when both are sent
+        client_etags = [client_etag.strip().removeprefix("W/") for client_etag in if_none_match.split(",")]
+        not_modified = etag in client_etags or "*" in client_etags
+    else:
+        modified_since = parse_date(request.headers.get("If-Modified-Since", ""))
+        not_modified = last_modified_is_final and modified_since != None and int(last_modified) <= modified_since
+    if not_modified:
+        return HTTPResponse(status=304, headers=headers)
+
+    for name, value in headers.items():
+        response.set_header(name, value)
+    return build_body()
+
+def get_config_last_modified(*file_paths) -> float:
+    return max(configLoaderService.get_config_signature(file_path)[0] / 1e9 for file_path in file_paths)
+
+def get_schedule_last_modified() -> float:
+    # Content depending on the current day also changes at midnight, even without any write
+    start_of_today = datetime.combine(date.today(), datetime.min.time()).timestamp()
+    return max(scheduleChangesService.get_last_changed_at(), start_of_today)
+
 @app.route("/tasks")
 def get_all_tasks():
-    tasks = configLoaderService.load_tasks_from_yaml()
-    return {"tasks": [task_to_model(task) for task in tasks]}
+    validator = ("tasks", configLoaderService.get_config_signature(configLoaderService.get_tasks_config_path()))
+    def build_body():
+        tasks = configLoaderService.load_tasks_from_yaml()
+        return {"tasks": [task_to_model(task) for task in tasks]}
+    return conditional_get(validator, get_config_last_modified(configLoaderService.get_tasks_config_path()), build_body)
 
 @app.route("/tasks/<task_id:int>")
 def get_task_by_id(task_id):
-    tasks = configLoaderService.load_tasks_from_yaml()
-    for task in tasks:
-        if task.task_id == task_id:
-            return task_to_model(task)
+    tasks_by_id = configLoaderService.load_tasks_from_yaml_as_id_dictionary()
+    if task_id in tasks_by_id:
+        return task_to_model(tasks_by_id[task_id])
     return HTTPError(404, "Task not found")
 
 @app.route("/scheduled-tasks/today")
 def read_scheduled_tasks_for_today():
-    with open_db_session() as con:
-        status = request.query.get("status")
-        tasks_today = scheduledTaskRepository.get_today_scheduled_tasks_by_status(con, status)
-    return {"tasks": [scheduledTask_to_model(task) for task in tasks_today]}
+    status = request.query.get("status")
+    validator = ("scheduled-tasks-today", date.today(), scheduleChangesService.get_schedule_validator(), status)
+    def build_body():
+        tasks_today = todayScheduleService.get_today_tasks(status)
+        response.content_type = "application/json"
+        return '{"tasks": ' + scheduledTasks_to_json_list(tasks_today) + "}"
+    return conditional_get(validator, get_schedule_last_modified(), build_body)
 
 @app.route("/notifications/scheduled-tasks")
 def get_notification_for_scheduled_tasks():
     language = request.query.get("language")
-    with open_db_session() as con:
-        notification = notificationService.get_notification_message(con, language)
-    return {"notification_available": notification.notification_available, "notification_message": notification.notification_message}
+    validator = ("notifications", language, scheduleChangesService.get_derived_state_key())
+    last_modified = max(get_schedule_last_modified(), get_config_last_modified(configLoaderService.get_tasks_config_path(), configLoaderService.get_users_config_path()))
+    def build_body():
+        notification = notificationService.get_notification_message(language)
+        return {"notification_available": notification.notification_available, "notification_message": notification.notification_message}
+    return conditional_get(validator, last_modified, build_body)
+
+@app.route("/scheduled-tasks/forecast")
+def get_scheduled_tasks_forecast():
+    days = request.query.get("days", "7")
+    if not days.isdigit():
+        return HTTPError(400, "The days parameter must be a positive number")
+    try:
+        return forecastService.get_forecast(int(days))
+    except ValueError as error:
+        return HTTPError(400, str(error))
+
+@app.route("/scheduled-tasks")
+def read_scheduled_tasks_history():
+    user_id = parse_optional_id(request.query.get("user_id"), "user_id")
+    task_id = parse_optional_id(request.query.get("task_id"), "task_id")
+    status = parse_task_status(request.query.status) if request.query.get("status") != None else None
+    from_date = parse_iso_date(request.query.from_date, "from_date") if request.query.get("from_date") != None else None
+    to_date = parse_iso_date(request.query.to_date, "to_date") if request.query.get("to_date") != None else None
+    after = parse_history_cursor(request.query.get("cursor"))
+    limit = request.query.get("limit", str(HISTORY_PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_HISTORY_PAGE_SIZE:
+        return HTTPError(400, f"The limit parameter must be a number between 1 and {MAX_HISTORY_PAGE_SIZE}")
+
+    validator = ("scheduled-tasks", scheduleChangesService.get_schedule_validator(), request.query_string)
+    def build_body():
+        # One more task is read to know if there is a next page
+        cursor = scheduledTaskRepository.get_scheduled_tasks_page(open_db_session(), int(limit) + 1, after, user_id, task_id, status, from_date, to_date)
+        response.content_type = "application/json"
+        return stream_scheduled_tasks_page(cursor, int(limit))
+    return conditional_get(validator, scheduleChangesService.get_last_changed_at(), build_body)
+
+@app.route("/scheduled-tasks/export")
+def export_scheduled_tasks():
+    format = request.query.get("format", "ndjson")
+    if format not in TRANSFER_FORMATS:
+        return HTTPError(400, f"The format must be one of {', '.join(TRANSFER_FORMATS)}")
+    response.content_type = TRANSFER_CONTENT_TYPES[format]
+    response.set_header("Content-Disposition", f'attachment; filename="scheduled-tasks.{format}"')
+    return historyTransferService.export_scheduled_tasks(format)
+
+@app.route("/scheduled-tasks/import", method="POST")
+def import_scheduled_tasks():
+    format = request.query.get("format", "ndjson")
+    # Bottle keeps big bodies on a temporary file, so they are read line by line
+    lines = io.TextIOWrapper(request.body, encoding="utf-8", newline="")
+    try:
+        result = historyTransferService.import_scheduled_tasks(lines, format)
+        if "aborted" in result:
+            # Part of the body was imported, the client needs the result to resume it
+            response.status = 400
+        return result
+    except (ValueError, csv.Error) as error:
+        return HTTPError(400, str(error))
+    finally:
+        lines.detach() # Otherwise closing the wrapper would close the body too
+
+def stream_scheduled_tasks_page(cursor, limit):
+    """Writes the page as the rows are read, so long histories are never fully loaded in memory"""
+    try:
+        chunk = ['{"tasks": [']
+        next_cursor = None
+        for index, scheduled_task in enumerate(cursor):
+            if index == limit:
+                next_cursor = format_history_cursor(previous_task)
+                break
+            chunk.append(("," if index > 0 else "") + scheduledTask_to_json(scheduled_task))
+            previous_task = scheduled_task
+            if len(chunk) >= HISTORY_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        chunk.append('], "next_cursor": ' + json.dumps(next_cursor) + "}")
+        yield "".join(chunk)
+    finally:
+        cursor.close()
+
+def format_history_cursor(scheduled_task):
+    return f"{scheduled_task.scheduled_date.isoformat()}.{scheduled_task.scheduled_task_id}"
+
+def parse_history_cursor(value):
+    if value == None:
+        return None
+    scheduled_date, _, scheduled_task_id = value.partition(".")
+    try:
+        return date.fromisoformat(scheduled_date), int(scheduled_task_id)
+    except ValueError:
+        raise HTTPError(400, "The cursor is not valid")
+
+def parse_optional_id(value, field_name):
+    if value == None:
+        return None
+    if not value.isdigit():
+        raise HTTPError(400, f"The {field_name} must be a number")
+    return int(value)
+
+@app.route("/statistics")
+def get_statistics():
+    validator = ("statistics", scheduleChangesService.get_derived_state_key())
+    last_modified = max(get_schedule_last_modified(), get_config_last_modified(configLoaderService.get_tasks_config_path(), configLoaderService.get_users_config_path()))
+    return conditional_get(validator, last_modified, statisticsService.get_statistics)
 
 @app.route("/scheduled-tasks/<scheduled_task_id:int>")
 def read_scheduled_task(scheduled_task_id):
@@ -65,38 +368,184 @@ def get_task_status_from_request_payload(request):
     data = request.json
     if 'status' not in data:
         raise HTTPError(400, "Status is required on payload")
-    if data['status'] not in (item.value for item in TaskStatus):
+    return parse_task_status(data['status'])
+
+def parse_task_status(value):
+    if value not in (item.value for item in TaskStatus):
         raise HTTPError(400, "The value is not a valid TaskStatus")
-    input_status = data['status'].upper()
-    return TaskStatus[input_status]
+    return TaskStatus[value.upper()]
+
+def parse_iso_date(value, field_name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"The {field_name} must be a date with format YYYY-MM-DD")
 
 @app.route("/scheduled-tasks/<scheduled_task_id:int>", method="PUT")
 def update_scheduled_task_status(scheduled_task_id):
     input_status = get_task_status_from_request_payload(request)
-    with open_db_session() as con:
-        scheduledTaskRepository.update_scheduled_task_status(con, scheduled_task_id, input_status)
-        con.commit()
+    writeQueueService.run(todayScheduleService.update_scheduled_task_status, scheduled_task_id, input_status)
+    scheduleChangesService.mark_schedule_changed({"type": "scheduled_task_updated", "scheduled_task_id": scheduled_task_id, "status": input_status.to_string()})
     return {"result": "ok"}
 
+@app.route("/scheduled-tasks", method="PUT")
+def update_scheduled_tasks_status():
+    data = request.json
+    if not data or ("tasks" not in data and "filter" not in data):
+        return HTTPError(400, "Either tasks or filter is required on payload")
+    if "tasks" in data:
+        return update_scheduled_tasks_status_by_id(data["tasks"])
+    return update_scheduled_tasks_status_by_filter(data["filter"], get_task_status_from_request_payload(request))
+
+def update_scheduled_tasks_status_by_id(items):
+    if not isinstance(items, list):
+        raise HTTPError(400, "The tasks must be a list")
+    status_by_scheduled_task_id = {}
+    results = []
+    for item in items:
+        scheduled_task_id = item.get("scheduled_task_id") if isinstance(item, dict) else None
+        status = item.get("status") if isinstance(item, dict) else None
+        # JSON true and false are ints for Python, but not ids
+        if not isinstance(scheduled_task_id, int) or isinstance(scheduled_task_id, bool):
+            results.append({"scheduled_task_id": scheduled_task_id, "result": "invalid_id"})
+        elif status not in (task_status.value for task_status in TaskStatus):
+            results.append({"scheduled_task_id": scheduled_task_id, "result": "invalid_status"})
+        else:
+            status_by_scheduled_task_id[scheduled_task_id] = TaskStatus[status.upper()]
+            results.append({"scheduled_task_id": scheduled_task_id, "result": None})
+
+    updated_ids = writeQueueService.run(scheduledTaskRepository.update_scheduled_tasks_status, status_by_scheduled_task_id)
+    if updated_ids:
+        updated_tasks = [{"scheduled_task_id": scheduled_task_id, "status": status_by_scheduled_task_id[scheduled_task_id].to_string()} for scheduled_task_id in updated_ids]
+        scheduleChangesService.mark_schedule_changed({"type": "scheduled_tasks_updated", "tasks": updated_tasks})
+
+    for result in results:
+        if result["result"] == None:
+            result["result"] = "ok" if result["scheduled_task_id"] in updated_ids else "not_found"
+    return {"results": results}
+
+def update_scheduled_tasks_status_by_filter(filter, to_status):
+    if not isinstance(filter, dict):
+        raise HTTPError(400, "The filter must be an object")
+    user_id = filter.get("user_id")
+    if user_id != None and (not isinstance(user_id, int) or isinstance(user_id, bool)):
+        raise HTTPError(400, "The user_id must be a number")
+    from_date = parse_iso_date(filter["from_date"], "from_date") if "from_date" in filter else None
+    to_date = parse_iso_date(filter["to_date"], "to_date") if "to_date" in filter else None
+    from_status = parse_task_status(filter["status"]) if "status" in filter else None
+    if user_id == None and from_date == None and to_date == None and from_status == None:
+        raise HTTPError(400, "At least one of user_id, from_date, to_date or status is required on filter")
+
+    updated_count = writeQueueService.run(scheduledTaskRepository.update_scheduled_tasks_status_by_filter, to_status, user_id, from_date, to_date, from_status)
+    if updated_count > 0:
+        scheduleChangesService.mark_schedule_changed({"type": "scheduled_tasks_updated", "filter": filter, "status": to_status.to_string()})
+    return {"result": "ok", "updated": updated_count}
+
 @app.route("/users/<user_id:int>/pending-tasks", method="PUT")
 def update_user_pending_tasks(user_id):
     input_status = get_task_status_from_request_payload(request)
-    with open_db_session() as con:
-        scheduledTaskRepository.update_tasks_status_for_user(con, user_id, TaskStatus.PENDING, input_status)
-        con.commit()
+    writeQueueService.run(todayScheduleService.update_tasks_status_for_user, user_id, TaskStatus.PENDING, input_status)
+    scheduleChangesService.mark_schedule_changed({"type": "user_tasks_updated", "user_id": user_id, "from_status": TaskStatus.PENDING.to_string(), "status": input_status.to_string()})
     return {"result": "ok"}
 
 @app.route("/users/<user_id:int>/pending-tasks")
 def get_user_pending_tasks(user_id):
-    with open_db_session() as con:
-        scheduled_tasks = scheduledTaskRepository.get_tasks_for_user(con, user_id, TaskStatus.PENDING)
-        return {"pending_tasks": [scheduledTask_to_model(task) for task in scheduled_tasks]}
+    validator = ("pending-tasks", user_id, scheduleChangesService.get_schedule_validator())
+    def build_body():
+        scheduled_tasks = todayScheduleService.get_pending_tasks_for_user(user_id)
+        response.content_type = "application/json"
+        return '{"pending_tasks": ' + scheduledTasks_to_json_list(scheduled_tasks) + "}"
+    return conditional_get(validator, scheduleChangesService.get_last_changed_at(), build_body)
+
+@app.route("/events")
+def get_schedule_events():
+    """Changes on the scheduled tasks, as a server-sent events stream or, for other clients, as a long-poll request"""
+    cursor = request.headers.get("Last-Event-ID") or request.query.get("since")
+    since_version = scheduleChangesService.parse_cursor(cursor)
+    streaming = "text/event-stream" in request.headers.get("Accept", "")
+    timeout = request.query.get("timeout", "30")
+    if not timeout.isdigit():
+        return HTTPError(400, "The timeout parameter must be a positive number")
+
+    if not eventSubscribers.acquire(blocking=False):
+        return HTTPError(503, "Too many event subscribers")
+    try:
+        if streaming:
+            response.content_type = "text/event-stream"
+            response.set_header("Cache-Control", "no-cache")
+            return stream_schedule_events(since_version)
+        return poll_schedule_events(since_version, min(int(timeout), EVENTS_MAX_POLL_SECONDS))
+    finally:
+        if not streaming:
+            eventSubscribers.release()
+
+def poll_schedule_events(since_version, timeout):
+    # Without a valid cursor the client has to refresh its state, and receive the events from now on
+    if since_version == None:
+        return {"cursor": scheduleChangesService.get_schedule_validator(), "resync": True, "events": []}
+    version, events, missed_events = scheduleChangesService.wait_for_events(since_version, timeout)
+    return {"cursor": scheduleChangesService.format_cursor(version), "resync": missed_events, "events": [event for _, event in events]}
+
+def stream_schedule_events(since_version):
+    try:
+        yield f"retry: {EVENTS_KEEP_ALIVE_SECONDS * 1000}\n\n"
+        if since_version == None:
+            since_version = scheduleChangesService.get_schedule_version()
+            yield format_server_sent_event(since_version, {"type": "resync"})
+        deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            version, events, missed_events = scheduleChangesService.wait_for_events(since_version, EVENTS_KEEP_ALIVE_SECONDS)
+            if missed_events:
+                yield format_server_sent_event(version, {"type": "resync"})
+                events = []
+            for event_version, event in events:
+                yield format_server_sent_event(event_version, event)
+            if version == since_version:
+                yield ": keep-alive\n\n"
+            since_version = version
+    finally:
+        eventSubscribers.release()
+
+def format_server_sent_event(version, event):
+    return f"id: {scheduleChangesService.format_cursor(version)}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
 
 @app.route("/generate-tasks", method="POST")
 def generate_tasks_endpoint():
-    generateTasksService.generate_daily_tasks()
+    run_generation("api")
     return {"result": "ok"}
 
+@app.route("/health")
+def get_health():
+    # The process is alive and answering, even while starting. A failed startup is never retried, so when nothing
+    # can be served it answers 503 and the watchdog of the Supervisor restarts the add-on
+    if startupError != None:
+        response.status = 503
+        return {"status": "failed", "error": startupError}
+    if failedHouseholds and len(failedHouseholds) == len(get_households()):
+        response.status = 503
+        return {"status": "failed", "error": "Every household failed to start", "households": failedHouseholds}
+    return {"status": "ok"}
+
+@app.route("/ready")
+def get_readiness():
+    if not startupFinished.is_set():
+        response.status = 503
+        return {"ready": False, "status": "starting"}
+    if startupError != None:
+        response.status = 503
+        return {"ready": False, "status": "failed", "error": startupError}
+    household_error = failedHouseholds.get(get_current_household().name)
+    if household_error != None:
+        response.status = 503
+        return {"ready": False, "status": "failed", "error": household_error}
+    return {"ready": True, "status": "ready"}
+
+@app.route("/metrics")
+def get_metrics():
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return metricsService.render()
+
 if __name__ == "__main__":
-    on_start()
-    serve(app, host="0.0.0.0", port=8000)
+    from waitress import serve
+    start_in_background()
+    serve(households_app, host="0.0.0.0", port=8000, threads=SERVER_THREADS)
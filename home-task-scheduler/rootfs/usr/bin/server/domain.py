@@ -1,6 +1,8 @@
 from enum import Enum
 from datetime import date
 
+DAY_LOOKUP = { 0: 'mon', 1: 'tue', 2: 'wed', 3: 'thu', 4: 'fri', 5: 'sat', 6: 'sun' }
+
 class TaskStatus(Enum):
     PENDING = "pending"
     COMPLETED = "completed"
@@ -11,7 +13,9 @@ class TaskStatus(Enum):
 
 class ScheduledTask():
     __tablename__ = "scheduled_tasks"
-    
+    # Lists of scheduled tasks can be long, slots make each instance smaller and faster to build
+    __slots__ = ("scheduled_task_id", "task_id", "user_id", "scheduled_date", "status")
+
     scheduled_task_id: int
     task_id: int
     user_id: int
@@ -25,9 +29,6 @@ class ScheduledTask():
         self.scheduled_date = scheduled_date
         self.status = status
 
-    def to_tuple(self):
-        return [self.task_id, self.user_id, self.scheduled_date, self.status.to_string()]
-
 class Task():
     task_id: int
     name: str
@@ -0,0 +1,52 @@
+"""Exports or imports the scheduled tasks history of a household, as NDJSON or CSV.
+
+The export can run while the add-on is running. Run the import with the add-on stopped (or use POST /scheduled-tasks/import instead),
+as the running server would not notice the imported tasks:
+    python3 /usr/bin/server/history_transfer.py export [--format ndjson|csv] [--household name] [file]
+    python3 /usr/bin/server/history_transfer.py import [--format ndjson|csv] [--household name] [file]
+Without a file, the export is written to the standard output and the import is read from the standard input.
+"""
+import argparse
+import contextlib
+import json
+import sys
+from repositories.database_client import init_db
+from services.history_transfer_service import HistoryTransferService, TRANSFER_FORMATS
+from household_context import get_household, use_household, DEFAULT_HOUSEHOLD_NAME
+
+historyTransferService = HistoryTransferService()
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports or imports the scheduled tasks history of a household")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("file", nargs="?", help="File to write or read, the standard output or input if not given")
+    parser.add_argument("--format", choices=TRANSFER_FORMATS, default="ndjson")
+    parser.add_argument("--household", default=DEFAULT_HOUSEHOLD_NAME)
+    args = parser.parse_intermixed_args()
+
+    household = get_household(args.household)
+    if household == None:
+        sys.exit(f"Household {args.household} not found")
+    with use_household(household):
+        init_db()
+        if args.action == "export":
+            with open(args.file, "w", encoding="utf-8", newline="") if args.file else contextlib.nullcontext(sys.stdout) as output:
+                for chunk in historyTransferService.export_scheduled_tasks(args.format):
+                    output.write(chunk)
+        else:
+            with open(args.file, "r", encoding="utf-8", newline="") if args.file else contextlib.nullcontext(sys.stdin) as lines:
+                try:
+                    result = historyTransferService.import_scheduled_tasks(lines, args.format)
+                except ValueError as error:
+                    sys.exit(str(error))
+            # The id mapping goes to the standard output, the summary to the error output
+            json.dump(result["id_mapping"], sys.stdout)
+            print(file=sys.stdout)
+            print(f"Imported {result['imported']} scheduled tasks into household {args.household}, {result['rejected']} rejected", file=sys.stderr)
+            for error in result["errors"]:
+                print(f"Line {error['line']}: {error['error']}", file=sys.stderr)
+            if "aborted" in result:
+                sys.exit(f"The import stopped after line {result['aborted']['after_line']}: {result['aborted']['error']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+from common import BASE_TARGET_PATH
+
+# The default household lives on BASE_TARGET_PATH, every other one on a folder of HOUSEHOLDS_PATH
+DEFAULT_HOUSEHOLD_NAME = "default"
+HOUSEHOLDS_PATH = BASE_TARGET_PATH + "households/"
+HOUSEHOLD_NAME_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+class Household():
+    name: str
+    base_path: str # Folder of its config and database files, ending with "/"
+
+    def __init__(self, name, base_path):
+        self.name = name
+        self.base_path = base_path
+
+# Discovered once, new households are picked up on the next start
+_households_by_name = None
+_households_lock = threading.Lock()
+# Household the current thread is working for (a request or a scheduled job)
+_current = threading.local()
+
+def get_households() -> dict[str, Household]:
+    global _households_by_name
+    with _households_lock:
+        if _households_by_name == None:
+            households_by_name = {DEFAULT_HOUSEHOLD_NAME: Household(DEFAULT_HOUSEHOLD_NAME, BASE_TARGET_PATH)}
+            if os.path.isdir(HOUSEHOLDS_PATH):
+                for name in sorted(os.listdir(HOUSEHOLDS_PATH)):
+                    if HOUSEHOLD_NAME_PATTERN.match(name) and name != DEFAULT_HOUSEHOLD_NAME and os.path.isdir(HOUSEHOLDS_PATH + name):
+                        households_by_name[name] = Household(name, HOUSEHOLDS_PATH + name + "/")
+            _households_by_name = households_by_name
+        return _households_by_name
+
+def get_household(name: str) -> Household:
+    return get_households().get(name)
+
+def get_current_household() -> Household:
+    household = getattr(_current, "household", None)
+    if household == None:
+        return get_households()[DEFAULT_HOUSEHOLD_NAME]
+    return household
+
+@contextmanager
+def use_household(household: Household):
+    """Makes the config files, database and caches of the household the ones used by the current thread"""
+    previous_household = getattr(_current, "household", None)
+    _current.household = household
+    try:
+        yield household
+    finally:
+        _current.household = previous_household
@@ -1,5 +1,7 @@
 from model import ScheduledTaskModel, TaskModel
 from domain import ScheduledTask, Task
+from datetime import date
+import functools
 
 def scheduledTask_to_model(domain: ScheduledTask):
     return ScheduledTaskModel(
@@ -10,6 +12,21 @@ def scheduledTask_to_model(domain: ScheduledTask):
             user_id=domain.user_id
         ).to_dict()
 
+def scheduledTask_to_json(domain: ScheduledTask) -> str:
+    """Same JSON as scheduledTask_to_model, written directly without the intermediate model and dict. Used for long lists"""
+    return (f'{{"scheduled_task_id": {_to_json_int(domain.scheduled_task_id)}, "task_id": {_to_json_int(domain.task_id)}, '
+            f'"scheduled_date": "{_to_iso_date(domain.scheduled_date)}", "user_id": {_to_json_int(domain.user_id)}, "status": "{domain.status.value}"}}')
+
+def scheduledTasks_to_json_list(domains) -> str:
+    return "[" + ", ".join(scheduledTask_to_json(domain) for domain in domains) + "]"
+
+def _to_json_int(value) -> str:
+    return "null" if value == None else str(value)
+
+@functools.lru_cache(maxsize=4096)
+def _to_iso_date(value: date) -> str:
+    return value.isoformat()
+
 def task_to_model(domain: Task):
     return TaskModel(
             task_id=domain.task_id,
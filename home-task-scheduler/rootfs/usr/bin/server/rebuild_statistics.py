@@ -0,0 +1,27 @@
+"""Computes the statistics counters again from the scheduled tasks history.
+
+They are kept up to date by the server, so this is only needed if the database was changed by other means.
+Run it with the add-on stopped, optionally with the name of a household (the default one otherwise):
+    python3 /usr/bin/server/rebuild_statistics.py [household]
+"""
+import sys
+from repositories.database_client import init_db, open_db_session
+from repositories.scheduled_task_stats_repository import ScheduledTaskStatsRepository
+from household_context import get_household, use_household, DEFAULT_HOUSEHOLD_NAME
+
+scheduledTaskStatsRepository = ScheduledTaskStatsRepository()
+
+def main():
+    household_name = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_HOUSEHOLD_NAME
+    household = get_household(household_name)
+    if household == None:
+        sys.exit(f"Household {household_name} not found")
+    with use_household(household):
+        init_db()
+        with open_db_session() as con:
+            scheduledTaskStatsRepository.rebuild(con)
+            con.commit()
+    print(f"Statistics of household {household_name} rebuilt")
+
+if __name__ == "__main__":
+    main()
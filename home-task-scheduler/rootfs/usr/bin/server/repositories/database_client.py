@@ -1,20 +1,279 @@
 import sqlite3
-from common import BASE_TARGET_PATH
+import logging
+import threading
+import time
+from datetime import date
+from common import HISTORY_RETENTION_DAYS
+from household_context import get_current_household
+from services.metrics_service import MetricsService
 
-# Create a new SQLite database and set up tables
-DATABASE_NAME = BASE_TARGET_PATH + 'database.db'
+logger = logging.getLogger(__name__)
+
+# Each household has its own SQLite database, on its config folder
+DATABASE_FILENAME = 'database.db'
+
+BUSY_TIMEOUT_SECONDS = 10
+MMAP_SIZE_BYTES = 32 * 1024 * 1024 # Kept small, as the add-on also runs on 32 bits devices
+CACHED_STATEMENTS = 256
+AUTO_VACUUM_INCREMENTAL = 2
+
+metricsService = MetricsService()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports the time spent on each statement to the metrics"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metricsService.observe_sql_statement(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metricsService.observe_sql_statement(time.perf_counter() - start)
+
+class InstrumentedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The connection shortcuts would create plain cursors otherwise
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Each thread (waitress workers, the scheduler) reuses its own connection to each database instead of opening one per request
+_thread_connections = threading.local()
+
+def _create_scheduled_tasks_table(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS scheduled_tasks (
+        scheduled_task_id INTEGER PRIMARY KEY,
+        task_id INTEGER,
+        scheduled_date TEXT,
+        user_id INTEGER,
+        status TEXT
+    )
+    """)
+
+def _store_scheduled_dates_as_day_numbers(con):
+    # Dates are stored as the proleptic Gregorian ordinal (date.toordinal()), which is smaller and faster to compare than ISO text
+    con.execute("""
+    CREATE TABLE scheduled_tasks_new (
+        scheduled_task_id INTEGER PRIMARY KEY,
+        task_id INTEGER,
+        scheduled_date INTEGER,
+        user_id INTEGER,
+        status TEXT
+    )
+    """)
+    con.execute("""
+    INSERT INTO scheduled_tasks_new (scheduled_task_id, task_id, scheduled_date, user_id, status)
+    SELECT scheduled_task_id, task_id, CAST(julianday(scheduled_date) - julianday('0001-01-01') AS INTEGER) + 1, user_id, status
+    FROM scheduled_tasks
+    """)
+    con.execute("DROP TABLE scheduled_tasks")
+    con.execute("ALTER TABLE scheduled_tasks_new RENAME TO scheduled_tasks")
+
+def _add_scheduled_tasks_indexes(con):
+    con.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_task_date ON scheduled_tasks (task_id, scheduled_date)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_date_status_user ON scheduled_tasks (scheduled_date, status, user_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_user_status ON scheduled_tasks (user_id, status)")
+
+def _add_task_schedule_state_table(con):
+    # Per task scheduling state, so the tasks due on a day can be found without scanning the history.
+    # next_due_date is 0 for tasks that were never scheduled, allowed_days_mask has bit N set when weekday N is allowed
+    con.execute("""
+    CREATE TABLE task_schedule_state (
+        task_id INTEGER PRIMARY KEY,
+        last_scheduled_date INTEGER,
+        days_interval INTEGER,
+        allowed_days_mask INTEGER NOT NULL DEFAULT 127,
+        next_due_date INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    con.execute("CREATE INDEX idx_task_schedule_state_next_due ON task_schedule_state (next_due_date)")
+    con.execute("""
+    INSERT INTO task_schedule_state (task_id, last_scheduled_date)
+    SELECT task_id, MAX(scheduled_date) FROM scheduled_tasks GROUP BY task_id
+    """)
+
+def _add_scheduled_task_rollups_table(con):
+    # Compact aggregate of the scheduled tasks removed by the history retention, one row per day, user, task and status
+    con.execute("""
+    CREATE TABLE scheduled_task_rollups (
+        scheduled_date INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        task_count INTEGER NOT NULL,
+        PRIMARY KEY (scheduled_date, user_id, task_id, status)
+    ) WITHOUT ROWID
+    """)
+    con.execute("CREATE INDEX idx_scheduled_task_rollups_task_date ON scheduled_task_rollups (task_id, scheduled_date)")
+
+def _add_scheduled_tasks_user_date_index(con):
+    # The history of a user is paged by date, without it every page sorts the whole history of the user
+    con.execute("CREATE INDEX idx_scheduled_tasks_user_date ON scheduled_tasks (user_id, scheduled_date)")
+
+def _add_scheduled_task_stats_tables(con):
+    # Statistics counters, kept up to date on every change of the scheduled tasks (but not by the history retention)
+    con.execute("""
+    CREATE TABLE scheduled_task_stats (
+        user_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        task_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, task_id, status)
+    ) WITHOUT ROWID
+    """)
+    con.execute("""
+    CREATE TABLE user_daily_stats (
+        user_id INTEGER NOT NULL,
+        scheduled_date INTEGER NOT NULL,
+        task_count INTEGER NOT NULL,
+        completed_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, scheduled_date)
+    ) WITHOUT ROWID
+    """)
+    con.execute("""
+    INSERT INTO scheduled_task_stats (user_id, task_id, status, task_count)
+    SELECT user_id, task_id, status, SUM(task_count) FROM (
+        SELECT user_id, task_id, status, 1 AS task_count FROM scheduled_tasks
+        UNION ALL
+        SELECT user_id, task_id, status, task_count FROM scheduled_task_rollups
+    ) GROUP BY user_id, task_id, status
+    """)
+    con.execute("""
+    INSERT INTO user_daily_stats (user_id, scheduled_date, task_count, completed_count)
+    SELECT user_id, scheduled_date, SUM(task_count), SUM(completed_count) FROM (
+        SELECT user_id, scheduled_date, 1 AS task_count, status='completed' AS completed_count FROM scheduled_tasks
+        UNION ALL
+        SELECT user_id, scheduled_date, task_count, CASE WHEN status='completed' THEN task_count ELSE 0 END FROM scheduled_task_rollups
+    ) GROUP BY user_id, scheduled_date
+    """)
+
+def _add_push_outbox_table(con):
+    # Notifications waiting to be pushed to Home Assistant, kept here so they survive restarts
+    con.execute("""
+    CREATE TABLE push_outbox (
+        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL
+    )
+    """)
+
+def _add_scheduled_tasks_pending_index(con):
+    # Pending tasks are a handful among the whole history, a partial index finds them without scanning it
+    con.execute("CREATE INDEX idx_scheduled_tasks_pending ON scheduled_tasks (status) WHERE status='pending'")
+
+def _add_generation_state_table(con):
+    # Last generated day, a single row. The last scheduled date can't tell it: no task may be due on the last days,
+    # and imported history may have future dates. Existing databases start from the last scheduled day up to today
+    con.execute("""
+    CREATE TABLE generation_state (
+        id INTEGER PRIMARY KEY CHECK (id=1),
+        last_generated_date INTEGER NOT NULL
+    )
+    """)
+    con.execute("""
+    INSERT INTO generation_state (id, last_generated_date)
+    SELECT 1, MAX(scheduled_date) FROM scheduled_tasks WHERE scheduled_date<=? HAVING MAX(scheduled_date) IS NOT NULL
+    """, [date.today().toordinal()])
+
+# Ordered schema migrations, the position on the list (starting at 1) is the schema version they lead to.
+# Never modify or reorder a released migration, append a new one instead.
+MIGRATIONS = [
+    _create_scheduled_tasks_table,
+    _store_scheduled_dates_as_day_numbers,
+    _add_scheduled_tasks_indexes,
+    _add_task_schedule_state_table,
+    _add_scheduled_task_rollups_table,
+    _add_scheduled_tasks_user_date_index,
+    _add_scheduled_task_stats_tables,
+    _add_push_outbox_table,
+    _add_scheduled_tasks_pending_index,
+    _add_generation_state_table,
+]
 
 def init_db():
-    with sqlite3.connect(DATABASE_NAME) as con:
-        con.execute("""
-        CREATE TABLE IF NOT EXISTS scheduled_tasks (
-            scheduled_task_id INTEGER PRIMARY KEY,
-            task_id INTEGER,
-            scheduled_date TEXT,
-            user_id INTEGER,
-            status TEXT
-        )
-        """)
+    con = _connect(isolation_level=None) # Transactions are handled explicitly for each migration
+    try:
+        is_new_database = con.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+        con.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        current_version = _get_schema_version(con)
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if version <= current_version:
+                continue
+            logger.info(f"Migrating database schema to version {version} ({migration.__name__})")
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                migration(con)
+                con.execute("DELETE FROM schema_version")
+                con.execute("INSERT INTO schema_version (version) VALUES (?)", [version])
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        # The VACUUM is free on a new database. Existing ones are only rewritten when the retention is turned on, as only it frees pages
+        if is_new_database or HISTORY_RETENTION_DAYS > 0:
+            _enable_incremental_vacuum(con)
+    finally:
+        con.close()
+
+def _enable_incremental_vacuum(con):
+    # Lets the history retention give the space of the removed rows back to the file system, little by little.
+    # Changing it on an existing database requires a full VACUUM, which can't run inside a transaction, so it is done once here
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        logger.info("Enabling incremental vacuum on the database, it may take a while on big databases")
+        con.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+        con.execute("VACUUM")
+
+def _get_schema_version(con) -> int:
+    row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    if row[0] == None:
+        return 0
+    return row[0]
 
 def open_db_session():
-    return sqlite3.connect(DATABASE_NAME)
+    """Returns the connection of the current thread to the database of the current household. Use it as 'with open_db_session() as con' to commit or rollback on exit"""
+    connections_by_path = getattr(_thread_connections, "connections_by_path", None)
+    if connections_by_path == None:
+        connections_by_path = _thread_connections.connections_by_path = {}
+    database_path = get_database_path()
+    con = connections_by_path.get(database_path)
+    if con == None:
+        con = connections_by_path[database_path] = _connect()
+    return con
+
+def open_writer_session():
+    """Returns the connection of the current thread to the database of the current household, in autocommit mode so
+    transactions are handled explicitly. Only used by the writer thread of WriteQueueService"""
+    connections_by_path = getattr(_thread_connections, "writer_connections_by_path", None)
+    if connections_by_path == None:
+        connections_by_path = _thread_connections.writer_connections_by_path = {}
+    database_path = get_database_path()
+    con = connections_by_path.get(database_path)
+    if con == None:
+        con = connections_by_path[database_path] = _connect(isolation_level=None)
+    return con
+
+def get_database_path() -> str:
+    return get_current_household().base_path + DATABASE_FILENAME
+
+def _connect(isolation_level=""):
+    con = sqlite3.connect(get_database_path(), timeout=BUSY_TIMEOUT_SECONDS, isolation_level=isolation_level, cached_statements=CACHED_STATEMENTS, factory=InstrumentedConnection)
+    # With WAL readers work on a snapshot and never wait for the writer (nor the writer for them)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_SECONDS * 1000}")
+    con.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    return con
@@ -0,0 +1,21 @@
+from sqlite3 import Connection
+from services.metrics_service import instrument_repository
+from datetime import date
+
+@instrument_repository
+class GenerationStateRepository:
+    """Last day whose tasks were generated. Must be written on the same transaction that generates it"""
+
+    def get_last_generated_date(self, con: Connection) -> date:
+        """Last generated day, or None if no day was generated yet"""
+        row = con.execute("SELECT last_generated_date FROM generation_state WHERE id=1").fetchone()
+        if row == None:
+            return None
+        return date.fromordinal(row[0])
+
+    def set_last_generated_date(self, con: Connection, generated_date: date):
+        query = """
+        INSERT INTO generation_state (id, last_generated_date) VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET last_generated_date=excluded.last_generated_date
+        """
+        con.execute(query, [generated_date.toordinal()])
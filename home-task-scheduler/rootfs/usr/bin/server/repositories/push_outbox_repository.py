@@ -0,0 +1,31 @@
+from sqlite3 import Connection
+from services.metrics_service import instrument_repository
+
+@instrument_repository
+class PushOutboxRepository:
+    """Notifications pending to be pushed, in the order they were added. Rows are removed once delivered"""
+
+    def add(self, con: Connection, payload: str, now: float, max_size: int) -> int:
+        """Adds a payload, due right away. The oldest ones are dropped beyond max_size, returns how many"""
+        con.execute("INSERT INTO push_outbox (payload, created_at, next_attempt_at) VALUES (?, ?, ?)", [payload, now, now])
+        cursor = con.execute("""
+        DELETE FROM push_outbox WHERE outbox_id <= (SELECT outbox_id FROM push_outbox ORDER BY outbox_id DESC LIMIT 1 OFFSET ?)
+        """, [max_size])
+        return cursor.rowcount
+
+    def get_oldest(self, con: Connection, limit: int) -> list[tuple]:
+        """Returns (outbox_id, payload, attempts) of the oldest rows"""
+        return con.execute("SELECT outbox_id, payload, attempts FROM push_outbox ORDER BY outbox_id LIMIT ?", [limit]).fetchall()
+
+    def get_next_attempt_at(self, con: Connection) -> float:
+        """Time at which the oldest row can be sent, or None if the outbox is empty"""
+        row = con.execute("SELECT next_attempt_at FROM push_outbox ORDER BY outbox_id LIMIT 1").fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    def mark_failed(self, con: Connection, outbox_ids: list[int], next_attempt_at: float):
+        con.cursor().executemany("UPDATE push_outbox SET attempts=attempts + 1, next_attempt_at=? WHERE outbox_id=?", [[next_attempt_at, outbox_id] for outbox_id in outbox_ids])
+
+    def delete(self, con: Connection, outbox_ids: list[int]):
+        con.cursor().executemany("DELETE FROM push_outbox WHERE outbox_id=?", [[outbox_id] for outbox_id in outbox_ids])
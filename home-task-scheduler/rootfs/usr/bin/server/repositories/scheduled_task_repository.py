@@ -1,6 +1,21 @@
 from sqlite3 import Connection
+from services.metrics_service import instrument_repository
 from domain import TaskStatus, ScheduledTask
+from repositories.task_schedule_state_repository import TaskScheduleStateRepository
+from repositories.scheduled_task_stats_repository import ScheduledTaskStatsRepository
 from datetime import date
+import functools
+
+taskScheduleStateRepository = TaskScheduleStateRepository()
+scheduledTaskStatsRepository = ScheduledTaskStatsRepository()
+
+MAX_QUERY_PARAMS = 500 # Keep IN (...) lists well below the SQLite host parameters limit
+
+# Columns are always selected in this order, so rows are decoded by position
+SCHEDULED_TASK_COLUMNS = "scheduled_task_id, task_id, user_id, scheduled_date, status"
+STATUS_BY_VALUE = {status.value: status for status in TaskStatus}
+# Rows share a few distinct days, so their date objects are reused
+_date_from_ordinal = functools.lru_cache(maxsize=4096)(date.fromordinal)
 
 class QueryAttribute:
     column: str
@@ -11,53 +26,148 @@ class QueryAttribute:
         self.operation = operation
         self.value = value
 
+@instrument_repository
 class ScheduledTaskRepository:
 
     def update_tasks_status_for_user(self, con: Connection, user_id: int, from_status: TaskStatus, to_status: TaskStatus):
+        scheduledTaskStatsRepository.on_tasks_status_changing(con, "user_id=? AND status=?", [user_id, from_status.value], to_status)
         cursor = con.cursor()
         query = "UPDATE scheduled_tasks SET status=? WHERE user_id=? AND status=?"
         params = [to_status.value, user_id, from_status.value]
         cursor.execute(query, params)
 
     def update_past_scheduled_tasks_status(self, con: Connection, from_status: TaskStatus, date: date, to_status: TaskStatus):
+        scheduledTaskStatsRepository.on_tasks_status_changing(con, "scheduled_date<? AND status=?", [date.toordinal(), from_status.value], to_status)
         cursor = con.cursor()
         query = "UPDATE scheduled_tasks SET status=? WHERE scheduled_date<? AND status=?"
-        params = [to_status.value, date.isoformat(), from_status.value]
+        params = [to_status.value, date.toordinal(), from_status.value]
         cursor.execute(query, params)
 
     def update_scheduled_task_status(self, con: Connection, scheduled_task_id: int, to_status: TaskStatus):
+        scheduledTaskStatsRepository.on_tasks_status_changing(con, "scheduled_task_id=?", [scheduled_task_id], to_status)
         cursor = con.cursor()
         query = "UPDATE scheduled_tasks SET status=? WHERE scheduled_task_id=?"
         params = [to_status.value, scheduled_task_id]
         cursor.execute(query, params)
 
-    def delete_non_completed_scheduled_tasks(self, con: Connection, date: date):
-        self._execute_scheduled_tasks_query("DELETE", con, [QueryAttribute("status", "!=", TaskStatus.COMPLETED.value), QueryAttribute("scheduled_date", "=", date)])
+    def update_scheduled_tasks_status(self, con: Connection, status_by_scheduled_task_id: dict[int, TaskStatus]) -> set[int]:
+        """Update the status of many scheduled tasks at once. Returns the ids that exist (and hence were updated)"""
+        scheduled_task_ids = list(status_by_scheduled_task_id)
+        existing_ids = set()
+        for start in range(0, len(scheduled_task_ids), MAX_QUERY_PARAMS):
+            chunk = scheduled_task_ids[start:start + MAX_QUERY_PARAMS]
+            query = f"SELECT scheduled_task_id FROM scheduled_tasks WHERE scheduled_task_id IN ({', '.join('?' * len(chunk))})"
+            existing_ids.update(row[0] for row in con.execute(query, chunk))
+
+        ids_by_status = {}
+        for scheduled_task_id in existing_ids:
+            ids_by_status.setdefault(status_by_scheduled_task_id[scheduled_task_id], []).append(scheduled_task_id)
+        for to_status, ids in ids_by_status.items():
+            for start in range(0, len(ids), MAX_QUERY_PARAMS):
+                chunk = ids[start:start + MAX_QUERY_PARAMS]
+                scheduledTaskStatsRepository.on_tasks_status_changing(con, f"scheduled_task_id IN ({', '.join('?' * len(chunk))})", chunk, to_status)
 
-    def get_last_scheduled_task(self, con: Connection, task_id: int):
-        order_query = " ORDER BY scheduled_date DESC"
-        cursor = self._execute_scheduled_tasks_query_with_subquery("SELECT *", con, [QueryAttribute("task_id", "=", task_id)], order_query)
-        return cursor.fetchone()
+        cursor = con.cursor()
+        query = "UPDATE scheduled_tasks SET status=? WHERE scheduled_task_id=?"
+        cursor.executemany(query, [[status_by_scheduled_task_id[scheduled_task_id].value, scheduled_task_id] for scheduled_task_id in existing_ids])
+        return existing_ids
+
+    def update_scheduled_tasks_status_by_filter(self, con: Connection, to_status: TaskStatus, user_id: int = None, from_date: date = None, to_date: date = None, from_status: TaskStatus = None) -> int:
+        """Update the status of every scheduled task matching all the given filters (dates are inclusive). Returns the number of updated tasks"""
+        query_attributes = []
+        if user_id != None:
+            query_attributes.append(QueryAttribute("user_id", "=", user_id))
+        if from_date != None:
+            query_attributes.append(QueryAttribute("scheduled_date", ">=", from_date))
+        if to_date != None:
+            query_attributes.append(QueryAttribute("scheduled_date", "<=", to_date))
+        if from_status != None:
+            query_attributes.append(QueryAttribute("status", "=", from_status.value))
+        if not query_attributes:
+            raise ValueError("At least one filter is required to update scheduled tasks")
+        where_clause, params = self._build_where_clause(query_attributes)
+        scheduledTaskStatsRepository.on_tasks_status_changing(con, where_clause, params, to_status)
+        cursor = con.cursor()
+        cursor.execute("UPDATE scheduled_tasks SET status=? WHERE " + where_clause, [to_status.value] + params)
+        return cursor.rowcount
+
+    def delete_non_completed_scheduled_tasks(self, con: Connection, date: date):
+        query_attributes = [QueryAttribute("status", "!=", TaskStatus.COMPLETED.value), QueryAttribute("scheduled_date", "=", date)]
+        scheduledTaskStatsRepository.on_tasks_deleting(con, *self._build_where_clause(query_attributes))
+        self._execute_scheduled_tasks_query("DELETE", con, query_attributes)
+        taskScheduleStateRepository.on_tasks_deleted(con, date)
+
+    def roll_up_scheduled_tasks(self, con: Connection, from_date: date, to_date: date) -> int:
+        """Move the scheduled tasks from from_date (inclusive) to to_date (exclusive) into the daily rollups. Returns the number of removed tasks"""
+        params = [from_date.toordinal(), to_date.toordinal()]
+        con.execute("""
+        INSERT INTO scheduled_task_rollups (scheduled_date, user_id, task_id, status, task_count)
+        SELECT scheduled_date, user_id, task_id, status, COUNT(*) FROM scheduled_tasks
+        WHERE scheduled_date>=? AND scheduled_date<?
+        GROUP BY scheduled_date, user_id, task_id, status
+        ON CONFLICT (scheduled_date, user_id, task_id, status) DO UPDATE SET task_count=task_count + excluded.task_count
+        """, params)
+        # The task schedule state is left as is, so the last scheduled date of each task is kept
+        cursor = con.execute("DELETE FROM scheduled_tasks WHERE scheduled_date>=? AND scheduled_date<?", params)
+        return cursor.rowcount
+
+    def get_first_scheduled_date(self, con: Connection) -> date:
+        row = con.execute("SELECT MIN(scheduled_date) FROM scheduled_tasks").fetchone()
+        if row[0] == None:
+            return None
+        return date.fromordinal(row[0])
 
     def get_tasks_for_user(self, con: Connection, user_id: str, task_status: TaskStatus):
-        cursor = self._execute_scheduled_tasks_query("SELECT *", con, [QueryAttribute("user_id", "=", user_id), QueryAttribute("status", "=", task_status.value)])
+        cursor = self._execute_scheduled_tasks_query("SELECT " + SCHEDULED_TASK_COLUMNS, con, [QueryAttribute("user_id", "=", user_id), QueryAttribute("status", "=", task_status.value)])
         return cursor.fetchall()
 
     def get_scheduled_task(self, con: Connection, scheduled_task_id: int):
-        cursor = self._execute_scheduled_tasks_query("SELECT *", con, [QueryAttribute("scheduled_task_id", "=", scheduled_task_id)])
+        cursor = self._execute_scheduled_tasks_query("SELECT " + SCHEDULED_TASK_COLUMNS, con, [QueryAttribute("scheduled_task_id", "=", scheduled_task_id)])
         return cursor.fetchone()
 
     def insert_scheduled_task(self, con: Connection, scheduled_task: ScheduledTask):
         cursor = con.cursor()
         query = "INSERT INTO scheduled_tasks (task_id, user_id, scheduled_date, status) VALUES (?, ?, ?, ?)"
-        cursor.execute(query, scheduled_task.to_tuple())
-    
-    def get_today_scheduled_tasks_by_status_and_user(self, con: Connection, status: str, user_id: int):
-        return self.get_scheduled_tasks(con, status, user_id, date.today())
-        
-    def get_today_scheduled_tasks_by_status(self, con: Connection, status: str):
-        return self.get_scheduled_tasks(con, status, None, date.today())
+        params = [scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date.toordinal(), scheduled_task.status.to_string()]
+        cursor.execute(query, params)
+        taskScheduleStateRepository.on_task_scheduled(con, scheduled_task.task_id, scheduled_task.scheduled_date)
+        scheduledTaskStatsRepository.on_task_inserted(con, scheduled_task)
+
+    def insert_scheduled_tasks(self, con: Connection, scheduled_tasks: list[ScheduledTask]):
+        """Same as insert_scheduled_task, with a single statement execution for all the tasks"""
+        query = "INSERT INTO scheduled_tasks (task_id, user_id, scheduled_date, status) VALUES (?, ?, ?, ?)"
+        params = [[scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date.toordinal(), scheduled_task.status.to_string()] for scheduled_task in scheduled_tasks]
+        con.cursor().executemany(query, params)
+        taskScheduleStateRepository.on_tasks_scheduled(con, [(scheduled_task.task_id, scheduled_task.scheduled_date) for scheduled_task in scheduled_tasks])
+        scheduledTaskStatsRepository.on_tasks_inserted(con, scheduled_tasks)
     
+    def insert_scheduled_tasks_with_new_ids(self, con: Connection, scheduled_tasks: list[ScheduledTask]) -> int:
+        """Same as insert_scheduled_tasks, giving the tasks consecutive ids after the last one (their own ids are ignored). Returns the first id"""
+        first_id = (con.execute("SELECT MAX(scheduled_task_id) FROM scheduled_tasks").fetchone()[0] or 0) + 1
+        query = "INSERT INTO scheduled_tasks (scheduled_task_id, task_id, user_id, scheduled_date, status) VALUES (?, ?, ?, ?, ?)"
+        params = [[first_id + index, scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date.toordinal(), scheduled_task.status.to_string()]
+                  for index, scheduled_task in enumerate(scheduled_tasks)]
+        con.cursor().executemany(query, params)
+        taskScheduleStateRepository.on_tasks_scheduled(con, [(scheduled_task.task_id, scheduled_task.scheduled_date) for scheduled_task in scheduled_tasks])
+        scheduledTaskStatsRepository.on_tasks_inserted(con, scheduled_tasks)
+        return first_id
+
+    def get_all_scheduled_tasks(self, con: Connection):
+        """Returns a cursor over every scheduled task, ordered by id"""
+        cursor = con.cursor()
+        cursor.row_factory = self._decode_scheduled_task
+        cursor.execute(f"SELECT {SCHEDULED_TASK_COLUMNS} FROM scheduled_tasks ORDER BY scheduled_task_id")
+        return cursor
+
+    def get_scheduled_tasks_on_date_or_pending(self, con: Connection, date: date):
+        """Scheduled tasks of the date (any status) and pending tasks of any date, ordered by date and id"""
+        # Each side of the OR uses its own index (the pending one is partial, so it stays tiny)
+        query = f"SELECT {SCHEDULED_TASK_COLUMNS} FROM scheduled_tasks WHERE scheduled_date=? OR status='pending' ORDER BY scheduled_date, scheduled_task_id"
+        cursor = con.cursor()
+        cursor.row_factory = self._decode_scheduled_task
+        cursor.execute(query, [date.toordinal()])
+        return cursor.fetchall()
+
     def get_scheduled_tasks(self, con: Connection, status: str, user_id: int, date: date):
         query_attributes = []
         if status != None:
@@ -65,36 +175,64 @@ class ScheduledTaskRepository:
         if user_id != None:
             query_attributes.append(QueryAttribute("user_id", "=", user_id))
         if date != None:
-            query_attributes.append(QueryAttribute("scheduled_date", "=", date.today()))
+            query_attributes.append(QueryAttribute("scheduled_date", "=", date))
 
-        cursor = self._execute_scheduled_tasks_query("SELECT *", con, query_attributes)
+        cursor = self._execute_scheduled_tasks_query("SELECT " + SCHEDULED_TASK_COLUMNS, con, query_attributes)
         return cursor.fetchall()
 
+    def get_scheduled_tasks_page(self, con: Connection, limit: int, after: tuple[date, int] = None, user_id: int = None, task_id: int = None,
+                                 status: TaskStatus = None, from_date: date = None, to_date: date = None):
+        """Scheduled tasks matching all the given filters (dates are inclusive), ordered by date and id, starting after the (scheduled_date, scheduled_task_id) key.
+        Returns the cursor, so the rows are read as they are iterated"""
+        query_attributes = []
+        if user_id != None:
+            query_attributes.append(QueryAttribute("user_id", "=", user_id))
+        if task_id != None:
+            query_attributes.append(QueryAttribute("task_id", "=", task_id))
+        if status != None:
+            query_attributes.append(QueryAttribute("status", "=", status.value))
+        if from_date != None:
+            query_attributes.append(QueryAttribute("scheduled_date", ">=", from_date))
+        if to_date != None:
+            query_attributes.append(QueryAttribute("scheduled_date", "<=", to_date))
+        where_clause, params = self._build_where_clause(query_attributes)
+        conditions = [where_clause] if where_clause else []
+        if after != None:
+            # Written so the scheduled_date range can use an index, a row value comparison or a plain OR can't
+            after_date, after_scheduled_task_id = after
+            conditions.append("scheduled_date>=? AND (scheduled_date>? OR scheduled_task_id>?)")
+            params += [after_date.toordinal(), after_date.toordinal(), after_scheduled_task_id]
+
+        query = f"SELECT {SCHEDULED_TASK_COLUMNS} FROM scheduled_tasks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY scheduled_date, scheduled_task_id LIMIT ?"
+        cursor = con.cursor()
+        cursor.row_factory = self._decode_scheduled_task
+        cursor.execute(query, params + [limit])
+        return cursor
+
     def _execute_scheduled_tasks_query_with_subquery(self, query_clause: str, con: Connection, query_attributes: list[QueryAttribute], subquery_query: str):
-        con.row_factory = self._dict_factory
         cursor = con.cursor()
-        query = query_clause + " FROM scheduled_tasks WHERE "
-        params = []
+        cursor.row_factory = self._decode_scheduled_task
+        where_clause, params = self._build_where_clause(query_attributes)
+        query = query_clause + " FROM scheduled_tasks WHERE " + where_clause + subquery_query
+        cursor.execute(query, params)
+        return cursor
 
+    def _build_where_clause(self, query_attributes: list[QueryAttribute]):
+        conditions = []
+        params = []
         for attribute in query_attributes:
-            if not query.strip().endswith("WHERE"):
-                query += " AND "
-            query += f"{attribute.column}{attribute.operation}?"
+            conditions.append(f"{attribute.column}{attribute.operation}?")
             final_param = attribute.value
             if isinstance(attribute.value, date): 
-                final_param = final_param.isoformat() # Convert date to string format (SQLite doesn't have a date type)
+                final_param = final_param.toordinal() # Dates are stored as day numbers (SQLite doesn't have a date type)
             params.append(final_param)
-        query += subquery_query
-        cursor.execute(query, params)
-        return cursor
+        return " AND ".join(conditions), params
 
     def _execute_scheduled_tasks_query(self, operation: str, con: Connection, query_attributes: list[QueryAttribute]):
         return self._execute_scheduled_tasks_query_with_subquery(operation, con, query_attributes, "")
     
-    def _dict_factory(self, cursor, row):
-        task_dict = {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
-        scheduled_date = date.fromisoformat(task_dict["scheduled_date"])
-        status = TaskStatus[task_dict["status"].upper()]
-        return ScheduledTask(scheduled_task_id=task_dict["scheduled_task_id"], task_id=task_dict["task_id"], user_id=task_dict["user_id"], scheduled_date=scheduled_date, status=status)
-
-
+    def _decode_scheduled_task(self, cursor, row):
+        return ScheduledTask(row[0], row[1], row[2], _date_from_ordinal(row[3]), STATUS_BY_VALUE[row[4]])
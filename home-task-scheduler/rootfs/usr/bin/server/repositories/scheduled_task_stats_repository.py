@@ -0,0 +1,84 @@
+from sqlite3 import Connection
+from services.metrics_service import instrument_repository
+from domain import TaskStatus, ScheduledTask
+from datetime import date
+from collections import Counter
+
+UPSERT_TASK_COUNTS = """
+INSERT INTO scheduled_task_stats (user_id, task_id, status, task_count) {select}
+ON CONFLICT (user_id, task_id, status) DO UPDATE SET task_count=task_count + excluded.task_count
+"""
+UPSERT_DAILY_COUNTS = """
+INSERT INTO user_daily_stats (user_id, scheduled_date, task_count, completed_count) {select}
+ON CONFLICT (user_id, scheduled_date) DO UPDATE SET
+    task_count=task_count + excluded.task_count,
+    completed_count=completed_count + excluded.completed_count
+"""
+
+@instrument_repository
+class ScheduledTaskStatsRepository:
+    """Keeps the statistics counters in sync with the scheduled_tasks. Must be used on the same transaction that changes them, right before the change.
+    The history retention doesn't go through it, so the counters keep the removed history"""
+
+    def on_task_inserted(self, con: Connection, scheduled_task: ScheduledTask):
+        self.on_tasks_inserted(con, [scheduled_task])
+
+    def on_tasks_inserted(self, con: Connection, scheduled_tasks: list[ScheduledTask]):
+        # Counted here first, so bulk inserts (catch-up, imports) upsert each counter once
+        task_counts = Counter((task.user_id, task.task_id, task.status.value) for task in scheduled_tasks)
+        daily_counts = {}
+        for task in scheduled_tasks:
+            counts = daily_counts.setdefault((task.user_id, task.scheduled_date.toordinal()), [0, 0])
+            counts[0] += 1
+            if task.status == TaskStatus.COMPLETED:
+                counts[1] += 1
+        con.cursor().executemany(UPSERT_TASK_COUNTS.format(select="VALUES (?, ?, ?, ?)"), [[*key, count] for key, count in task_counts.items()])
+        con.cursor().executemany(UPSERT_DAILY_COUNTS.format(select="VALUES (?, ?, ?, ?)"), [[*key, *counts] for key, counts in daily_counts.items()])
+
+    def on_tasks_status_changing(self, con: Connection, where_clause: str, params: list, to_status: TaskStatus):
+        """Moves the counts of the scheduled tasks matching where_clause (and not already on to_status) to to_status"""
+        changing_tasks = f"FROM scheduled_tasks WHERE ({where_clause}) AND status!=?"
+        changing_params = params + [to_status.value]
+        con.execute(UPSERT_TASK_COUNTS.format(select=f"SELECT user_id, task_id, status, -COUNT(*) {changing_tasks} GROUP BY user_id, task_id, status"), changing_params)
+        con.execute(UPSERT_TASK_COUNTS.format(select=f"SELECT user_id, task_id, ?, COUNT(*) {changing_tasks} GROUP BY user_id, task_id"), [to_status.value] + changing_params)
+
+        # The daily counters only change for the tasks that become, or stop being, completed
+        if to_status == TaskStatus.COMPLETED:
+            select = f"SELECT user_id, scheduled_date, 0, COUNT(*) {changing_tasks} GROUP BY user_id, scheduled_date"
+            con.execute(UPSERT_DAILY_COUNTS.format(select=select), changing_params)
+        else:
+            select = f"SELECT user_id, scheduled_date, 0, -COUNT(*) {changing_tasks} AND status=? GROUP BY user_id, scheduled_date"
+            con.execute(UPSERT_DAILY_COUNTS.format(select=select), changing_params + [TaskStatus.COMPLETED.value])
+
+    def on_tasks_deleting(self, con: Connection, where_clause: str, params: list):
+        deleted_tasks = f"FROM scheduled_tasks WHERE {where_clause}"
+        con.execute(UPSERT_TASK_COUNTS.format(select=f"SELECT user_id, task_id, status, -COUNT(*) {deleted_tasks} GROUP BY user_id, task_id, status"), params)
+        select = f"SELECT user_id, scheduled_date, -COUNT(*), -SUM(status=?) {deleted_tasks} GROUP BY user_id, scheduled_date"
+        con.execute(UPSERT_DAILY_COUNTS.format(select=select), [TaskStatus.COMPLETED.value] + params)
+
+    def rebuild(self, con: Connection):
+        """Computes the counters again from the scheduled tasks and the rolled up history"""
+        all_tasks = """(
+            SELECT user_id, task_id, scheduled_date, status, 1 AS task_count FROM scheduled_tasks
+            UNION ALL
+            SELECT user_id, task_id, scheduled_date, status, task_count FROM scheduled_task_rollups
+        )"""
+        con.execute("DELETE FROM scheduled_task_stats")
+        con.execute(f"""
+        INSERT INTO scheduled_task_stats (user_id, task_id, status, task_count)
+        SELECT user_id, task_id, status, SUM(task_count) FROM {all_tasks} GROUP BY user_id, task_id, status
+        """)
+        con.execute("DELETE FROM user_daily_stats")
+        con.execute(f"""
+        INSERT INTO user_daily_stats (user_id, scheduled_date, task_count, completed_count)
+        SELECT user_id, scheduled_date, SUM(task_count), SUM(CASE WHEN status=? THEN task_count ELSE 0 END) FROM {all_tasks} GROUP BY user_id, scheduled_date
+        """, [TaskStatus.COMPLETED.value])
+
+    def get_task_counts(self, con: Connection) -> list[tuple]:
+        """Returns (user_id, task_id, status, count) for every non empty counter"""
+        return con.execute("SELECT user_id, task_id, status, task_count FROM scheduled_task_stats WHERE task_count>0").fetchall()
+
+    def get_daily_counts_backwards(self, con: Connection, user_id: int, until: date):
+        """Returns a cursor over (scheduled_date, task_count, completed_count) of a user, from until to the oldest day"""
+        query = "SELECT scheduled_date, task_count, completed_count FROM user_daily_stats WHERE user_id=? AND scheduled_date<=? ORDER BY scheduled_date DESC"
+        return con.execute(query, [user_id, until.toordinal()])
@@ -0,0 +1,73 @@
+from sqlite3 import Connection
+from services.metrics_service import instrument_repository
+from domain import Task, DAY_LOOKUP
+from datetime import date
+
+ALL_DAYS_MASK = 0b1111111
+DAY_BITS_BY_NAME = {day_name: 1 << weekday for weekday, day_name in DAY_LOOKUP.items()}
+
+@instrument_repository
+class TaskScheduleStateRepository:
+    """Keeps task_schedule_state in sync with the scheduled_tasks history. Must be used on the same transaction that changes it"""
+
+    def sync_tasks_config(self, con: Connection, tasks: list[Task]):
+        # Only rows whose interval or allowed days changed on the config are actually written
+        query = """
+        INSERT INTO task_schedule_state (task_id, days_interval, allowed_days_mask) VALUES (?, ?, ?)
+        ON CONFLICT(task_id) DO UPDATE SET
+            days_interval=excluded.days_interval,
+            allowed_days_mask=excluded.allowed_days_mask,
+            next_due_date=COALESCE(last_scheduled_date + excluded.days_interval, 0)
+        WHERE days_interval IS NOT excluded.days_interval OR allowed_days_mask IS NOT excluded.allowed_days_mask
+        """
+        params = [[task.task_id, task.days_interval, self.get_allowed_days_mask(task)] for task in tasks]
+        con.cursor().executemany(query, params)
+
+    def get_due_task_ids(self, con: Connection, date: date) -> set[int]:
+        query = "SELECT task_id FROM task_schedule_state WHERE next_due_date<=? AND allowed_days_mask & ? != 0"
+        params = [date.toordinal(), 1 << date.weekday()]
+        return {row[0] for row in con.execute(query, params)}
+
+    def get_last_scheduled_dates(self, con: Connection) -> dict[int, date]:
+        query = "SELECT task_id, last_scheduled_date FROM task_schedule_state WHERE last_scheduled_date IS NOT NULL"
+        return {row[0]: date.fromordinal(row[1]) for row in con.execute(query)}
+
+    def on_task_scheduled(self, con: Connection, task_id: int, scheduled_date: date):
+        self.on_tasks_scheduled(con, [(task_id, scheduled_date)])
+
+    def on_tasks_scheduled(self, con: Connection, scheduled_dates: list[tuple[int, date]]):
+        """Takes (task_id, scheduled_date) pairs"""
+        query = """
+        INSERT INTO task_schedule_state (task_id, last_scheduled_date) VALUES (?, ?)
+        ON CONFLICT(task_id) DO UPDATE SET
+            last_scheduled_date=MAX(COALESCE(last_scheduled_date, excluded.last_scheduled_date), excluded.last_scheduled_date),
+            next_due_date=COALESCE(MAX(COALESCE(last_scheduled_date, excluded.last_scheduled_date), excluded.last_scheduled_date) + days_interval, 0)
+        """
+        # Only the last date of each task matters
+        last_dates = {}
+        for task_id, scheduled_date in scheduled_dates:
+            if task_id not in last_dates or last_dates[task_id] < scheduled_date:
+                last_dates[task_id] = scheduled_date
+        con.cursor().executemany(query, [[task_id, scheduled_date.toordinal()] for task_id, scheduled_date in last_dates.items()])
+
+    def on_tasks_deleted(self, con: Connection, scheduled_date: date):
+        # Only the tasks whose last schedule was on that date can move back to a previous one
+        # Older history may only be on the rollups, if it was already removed by the retention
+        last_date_query = """COALESCE(
+            (SELECT MAX(scheduled_date) FROM scheduled_tasks WHERE scheduled_tasks.task_id=task_schedule_state.task_id),
+            (SELECT MAX(scheduled_date) FROM scheduled_task_rollups WHERE scheduled_task_rollups.task_id=task_schedule_state.task_id))"""
+        query = f"""
+        UPDATE task_schedule_state SET
+            last_scheduled_date=({last_date_query}),
+            next_due_date=COALESCE(({last_date_query}) + days_interval, 0)
+        WHERE last_scheduled_date=?
+        """
+        con.execute(query, [scheduled_date.toordinal()])
+
+    def get_allowed_days_mask(self, task: Task) -> int:
+        if task.allowed_days == None:
+            return ALL_DAYS_MASK
+        mask = 0
+        for day_name in task.allowed_days:
+            mask |= DAY_BITS_BY_NAME.get(day_name, 0)
+        return mask
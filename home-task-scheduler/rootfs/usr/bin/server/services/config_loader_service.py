@@ -1,69 +1,117 @@
-import yaml
 import os
 import shutil
+import threading
+import time
 from domain import User, Task
-from common import BASE_TARGET_PATH
+from household_context import get_current_household
+from services.metrics_service import MetricsService
 
 ABS_SOURCE_PATH = "/usr/bin/server/initial_config/"
 REL_SOURCE_PATH = "./initial_config/"
 TASKS_CONFIG_FILENAME = "tasks.yaml"
 USERS_CONFIG_FILENAME = "users.yaml"
 
-TASKS_CONFIG_PATH = BASE_TARGET_PATH + TASKS_CONFIG_FILENAME
-USERS_CONFIG_PATH = BASE_TARGET_PATH + USERS_CONFIG_FILENAME
+class ConfigSnapshot():
+    """Parsed and validated content of a config file, as it was when the file had the given signature"""
+    signature: tuple
+    items: tuple
+    items_by_id: dict
+
+    def __init__(self, signature, items, items_by_id):
+        self.signature = signature
+        self.items = items
+        self.items_by_id = items_by_id
+
+# Shared by every ConfigLoaderService instance, so a file is parsed once per change and not once per caller
+_snapshots_by_path = {}
+_snapshots_lock = threading.Lock()
+
+metricsService = MetricsService()
 
 class ConfigLoaderService:
 
-    def load_tasks_from_yaml(self, file_path=TASKS_CONFIG_PATH) -> list[Task]:
-        with open(file_path, "r", encoding='utf-8') as file:
-            tasks = yaml.safe_load(file)
-        return [Task(task["id"], task["name"], task["days_interval"], task["effort"], self.get_task_allowed_days(task)) for task in tasks]
+    def get_tasks_config_path(self) -> str:
+        return get_current_household().base_path + TASKS_CONFIG_FILENAME
 
-    def load_tasks_from_yaml_as_id_dictionary(self, file_path=TASKS_CONFIG_PATH) -> dict[Task]:
-        tasks = self.load_tasks_from_yaml(file_path)
-        id_dictionary = {}
-        for task in tasks:
-            task_id = task.task_id
-            if task_id in id_dictionary:
-                raise ValueError(f"Duplicate ID {task_id} found in tasks.")
-            id_dictionary[task_id] = task
-        return id_dictionary
+    def get_users_config_path(self) -> str:
+        return get_current_household().base_path + USERS_CONFIG_FILENAME
+
+    def load_tasks_from_yaml(self, file_path=None) -> list[Task]:
+        return list(self._get_snapshot(file_path or self.get_tasks_config_path(), self._parse_tasks, lambda task: task.task_id, "tasks").items)
+
+    def load_tasks_from_yaml_as_id_dictionary(self, file_path=None) -> dict[Task]:
+        return dict(self._get_snapshot(file_path or self.get_tasks_config_path(), self._parse_tasks, lambda task: task.task_id, "tasks").items_by_id)
+
+    def load_users_from_yaml(self, file_path=None) -> list[User]:
+        return list(self._get_snapshot(file_path or self.get_users_config_path(), self._parse_users, lambda user: user.id, "users").items)
 
-    def load_users_from_yaml(self, file_path=USERS_CONFIG_PATH) -> list[User]:
-        with open(file_path, "r", encoding='utf-8') as file:
-            users_data = yaml.safe_load(file)
+    def load_users_by_id_from_yaml(self, file_path=None) -> dict[User]:
+        return dict(self._get_snapshot(file_path or self.get_users_config_path(), self._parse_users, lambda user: user.id, "users").items_by_id)
+
+    def get_config_signature(self, file_path: str) -> tuple:
+        # Cheap change detector for a config file, without reading its content
+        stat = os.stat(file_path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _get_snapshot(self, file_path: str, parser, id_getter, entity_name: str) -> ConfigSnapshot:
+        signature = self.get_config_signature(file_path)
+        snapshot = _snapshots_by_path.get(file_path)
+        if snapshot != None and snapshot.signature == signature:
+            return snapshot
+
+        with _snapshots_lock:
+            # Another thread may have reloaded the file while we were waiting for the lock
+            snapshot = _snapshots_by_path.get(file_path)
+            if snapshot != None and snapshot.signature == signature:
+                return snapshot
+            import yaml # Only needed when a file changes, and slow to import
+            start = time.perf_counter()
+            with open(file_path, "r", encoding='utf-8') as file:
+                items = tuple(parser(yaml.safe_load(file) or []))
+            metricsService.observe_config_load(file_path, time.perf_counter() - start)
+            snapshot = ConfigSnapshot(signature, items, self._index_by_id(items, id_getter, entity_name))
+            _snapshots_by_path[file_path] = snapshot
+            return snapshot
+
+    def _parse_tasks(self, tasks: list) -> list[Task]:
+        return [Task(task["id"], task["name"], task["days_interval"], task["effort"], self.get_task_allowed_days(task)) for task in tasks]
+
+    def _parse_users(self, users_data: list) -> list[User]:
         return [User(user["id"], user["username"], user["available_daily_effort"]) for user in users_data]
 
-    def load_users_by_id_from_yaml(self, file_path=USERS_CONFIG_PATH) -> dict[User]:
-        users = self.load_users_from_yaml(file_path)
+    def _index_by_id(self, items: tuple, id_getter, entity_name: str) -> dict:
         id_dictionary = {}
-        for user in users:
-            user_id = user.id
-            if user_id in id_dictionary:
-                raise ValueError(f"Duplicate ID {user_id} found in users.")
-            id_dictionary[user_id] = user
-        return users
+        for item in items:
+            item_id = id_getter(item)
+            if item_id in id_dictionary:
+                raise ValueError(f"Duplicate ID {item_id} found in {entity_name}.")
+            id_dictionary[item_id] = item
+        return id_dictionary
 
     def create_config_dir(self):
-        # If there is no /config folder created, it creates it and adds initial content to it
-        if not os.path.exists(BASE_TARGET_PATH):
-            print(f"Creating config folder {BASE_TARGET_PATH} and initial contents...")
-            os.makedirs(BASE_TARGET_PATH)  # Create directory
-
-            # Now let's copy the yaml files into it
-            yaml_files = [TASKS_CONFIG_FILENAME, USERS_CONFIG_FILENAME]
-
-            for yaml_file in yaml_files:
-                abs_source_yaml_path = ABS_SOURCE_PATH + yaml_file
-                rel_source_yaml_path = REL_SOURCE_PATH + yaml_file
-                if os.path.exists(abs_source_yaml_path):
-                    shutil.copy(abs_source_yaml_path, BASE_TARGET_PATH)
-                elif os.path.exists(rel_source_yaml_path):
-                    shutil.copy(rel_source_yaml_path, BASE_TARGET_PATH)
-                else:
-                    print(f"Warning: {yaml_file} was not found and hence not copied.")
+        # If there is no /config folder created (for the current household), it creates it and adds initial content to it.
+        # Household folders are created by hand, so the config files they are missing are also added
+        base_target_path = get_current_household().base_path
+        if not os.path.exists(base_target_path):
+            print(f"Creating config folder {base_target_path} and initial contents...")
+            os.makedirs(base_target_path)  # Create directory
         else:
-            print(f"The directory {BASE_TARGET_PATH} already exists, not filling it")
+            print(f"The directory {base_target_path} already exists, only adding the missing config files")
+
+        # Now let's copy the yaml files into it
+        yaml_files = [TASKS_CONFIG_FILENAME, USERS_CONFIG_FILENAME]
+
+        for yaml_file in yaml_files:
+            if os.path.exists(base_target_path + yaml_file):
+                continue
+            abs_source_yaml_path = ABS_SOURCE_PATH + yaml_file
+            rel_source_yaml_path = REL_SOURCE_PATH + yaml_file
+            if os.path.exists(abs_source_yaml_path):
+                shutil.copy(abs_source_yaml_path, base_target_path)
+            elif os.path.exists(rel_source_yaml_path):
+                shutil.copy(rel_source_yaml_path, base_target_path)
+            else:
+                print(f"Warning: {yaml_file} was not found and hence not copied.")
 
     def get_task_allowed_days(self, task: dict):
         if "allowed_days" in task:
@@ -0,0 +1,76 @@
+from services.config_loader_service import ConfigLoaderService
+from services.users_service import UsersService
+from services.schedule_changes_service import DerivedStateCache
+from services.generate_tasks_service import GenerateTasksService
+from services.task_assignment_service import DailyTaskAssigner, AssignmentStrategy
+from repositories.database_client import open_db_session
+from repositories.task_schedule_state_repository import TaskScheduleStateRepository
+from datetime import date, timedelta
+import random
+
+configLoaderService = ConfigLoaderService()
+usersService = UsersService()
+taskScheduleStateRepository = TaskScheduleStateRepository()
+
+MAX_FORECAST_DAYS = 365
+
+class ForecastService:
+    """Simulates in memory what the daily generation would assign on the next days. Nothing is written to the database"""
+
+    def __init__(self, assignment_strategy: AssignmentStrategy = AssignmentStrategy.LEAST_LOADED):
+        self.assignment_strategy = assignment_strategy
+        self._generateTasksService = GenerateTasksService(assignment_strategy)
+        # Forecasts by number of days, they only change when the scheduled tasks, the config files or the current day change
+        self._cache = DerivedStateCache()
+
+    def get_forecast(self, days: int) -> dict:
+        if days < 1 or days > MAX_FORECAST_DAYS:
+            raise ValueError(f"The forecast days must be between 1 and {MAX_FORECAST_DAYS}")
+        return self._cache.get(days, lambda: self._build_forecast(date.today() + timedelta(days=1), days))
+
+    def _build_forecast(self, first_day: date, days: int) -> dict:
+        tasks = configLoaderService.load_tasks_from_yaml()
+        users = usersService.list_users()
+        usernames_by_id = {user.id: user.username for user in users}
+        with open_db_session() as con:
+            last_scheduled_dates = taskScheduleStateRepository.get_last_scheduled_dates(con)
+
+        # The same seed for the same first day, so repeated forecasts are stable
+        rng = random.Random(first_day.toordinal())
+        allowed_days_mask_by_task = {task.task_id: taskScheduleStateRepository.get_allowed_days_mask(task) for task in tasks}
+
+        # Rolling state: tasks already due and waiting for a day with capacity, and tasks by the day they become due
+        first_ordinal = first_day.toordinal()
+        due_tasks = []
+        tasks_by_due_ordinal = {}
+        for task in tasks:
+            last_scheduled = last_scheduled_dates.get(task.task_id)
+            due_ordinal = first_ordinal if last_scheduled == None else last_scheduled.toordinal() + task.days_interval
+            if due_ordinal <= first_ordinal:
+                due_tasks.append(task)
+            else:
+                tasks_by_due_ordinal.setdefault(due_ordinal, []).append(task)
+
+        forecast_days = []
+        for ordinal in range(first_ordinal, first_ordinal + days):
+            day = date.fromordinal(ordinal)
+            due_tasks.extend(tasks_by_due_ordinal.pop(ordinal, []))
+            rng.shuffle(due_tasks)
+            weekday_bit = 1 << day.weekday()
+            allowed_tasks = [task for task in due_tasks if allowed_days_mask_by_task[task.task_id] & weekday_bit]
+
+            assigner = DailyTaskAssigner(users, day, self.assignment_strategy)
+            assignments, unassigned_effort = self._generateTasksService.plan_daily_assignments(allowed_tasks, assigner)
+
+            scheduled_task_ids = set()
+            for task, user in assignments:
+                scheduled_task_ids.add(task.task_id)
+                tasks_by_due_ordinal.setdefault(ordinal + max(task.days_interval, 1), []).append(task)
+            due_tasks = [task for task in due_tasks if task.task_id not in scheduled_task_ids]
+
+            forecast_days.append({
+                "date": day.isoformat(),
+                "assignments": [{"task_id": task.task_id, "name": task.name, "effort": task.effort, "user_id": user.id, "username": usernames_by_id[user.id]} for task, user in assignments],
+                "unassigned_effort": unassigned_effort
+            })
+        return {"days": forecast_days}
@@ -1,89 +1,154 @@
 from services.config_loader_service import ConfigLoaderService
-from domain import ScheduledTask, TaskStatus, User
+from domain import ScheduledTask, Task, TaskStatus, DAY_LOOKUP
 from services.users_service import UsersService
-from repositories.database_client import open_db_session
+from services.schedule_changes_service import ScheduleChangesService
+from services.task_assignment_service import DailyTaskAssigner, AssignmentStrategy
+from services.write_queue_service import WriteQueueService
+from services.today_schedule_service import TodayScheduleService
 from repositories.scheduled_task_repository import ScheduledTaskRepository
-from datetime import date
+from repositories.task_schedule_state_repository import TaskScheduleStateRepository
+from repositories.generation_state_repository import GenerationStateRepository
+from datetime import date, timedelta
 import random
 import logging
 
-DAY_LOOKUP = { 0: 'mon', 1: 'tue', 2: 'wed', 3: 'thu', 4: 'fri', 5: 'sat', 6: 'sun' }
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 scheduledTaskRepository = ScheduledTaskRepository()
+taskScheduleStateRepository = TaskScheduleStateRepository()
+generationStateRepository = GenerationStateRepository()
 configLoaderService = ConfigLoaderService()
 usersService = UsersService()
+scheduleChangesService = ScheduleChangesService()
+writeQueueService = WriteQueueService()
+todayScheduleService = TodayScheduleService()
+
+MAX_CATCH_UP_DAYS = 31 # After longer outages, only the last days are generated
 
 class GenerateTasksService:
 
+    def __init__(self, assignment_strategy: AssignmentStrategy = AssignmentStrategy.LEAST_LOADED, seed: int = None):
+        self.assignment_strategy = assignment_strategy
+        # A fixed seed makes the task order (and hence the assignments) reproducible, useful to compare strategies
+        self._random = random.Random(seed)
+
     def generate_daily_tasks(self):
         today = date.today()
+        self.generate_missed_days(today)
         logger.info(f"Running task scheduler on {DAY_LOOKUP[today.weekday()]} {str(today)}")
         tasks = configLoaderService.load_tasks_from_yaml()
-        random.shuffle(tasks)
+        self._random.shuffle(tasks)
         users = usersService.list_users()
-        used_effort_by_user = {user.id: 0 for user in users}
-        self._log_user_available_efforts(today, users)
-
-        with open_db_session() as con:
-            self._delete_pending_tasks_on_date(today, con) # Pending tasks today are being deleted to avoid issues while re-running
-            self._mark_as_incompleted_previous_days_pending_tasks(today, con)
-            todays_scheduled_task_ids = self._get_today_scheduled_task_ids(con, today)
-
-            # First assign the mandatory tasks (zero effort)
-            mandatory_task_ids_assigned = self._assign_mandatory_tasks(tasks, today, users, todays_scheduled_task_ids, con)
-
-            # Then the time-consuming tasks
-            unasigned_effort = 0
-            for task in tasks:
-                if task.task_id in mandatory_task_ids_assigned:
-                    continue
-                user = self._get_user_to_assign(task, users, used_effort_by_user, today)
-                if user != None:
-                    if self._schedule_task_for_today(task, today, todays_scheduled_task_ids, con, user):
-                        used_effort_by_user[user.id] = used_effort_by_user[user.id] + task.effort
-                else:
-                    unasigned_effort += task.effort
-                    logger.debug(f"Task {task.name} cannot be scheduled as there is not effort remaining")
-
-            if unasigned_effort > 0:
-                logger.warn(f"There are a total of {unasigned_effort} effort points not assigned as there is not enough capacity")
+        assigner = DailyTaskAssigner(users, today, self.assignment_strategy)
+        self._log_user_available_efforts(assigner, users)
 
-            con.commit()
+        # A single write, so no status change can be committed in the middle of the generation
+        writeQueueService.run(self._generate_day, today, tasks, assigner)
+        todayScheduleService.load()
+        scheduleChangesService.mark_schedule_changed({"type": "tasks_generated", "date": today.isoformat()})
         logger.info(f"Task scheduler finished")
 
-    def _get_remaining_user_effort(self, date, user: User, used_effort: int) -> int:
-        current_day = DAY_LOOKUP[date.weekday()]
-        return user.available_daily_effort[current_day] - used_effort
+    def generate_missed_days(self, today: date) -> int:
+        """Generate the days between the last generated one and today (excluded), if the add-on was not running on them.
+        Their tasks are left pending, the generation of today marks them as incomplete. Returns the number of generated days"""
+        first_day = writeQueueService.run(self._generate_missed_days, today)
+        if first_day == None:
+            return 0
+        scheduleChangesService.mark_schedule_changed({"type": "tasks_generated", "from_date": first_day.isoformat(), "to_date": (today - timedelta(days=1)).isoformat()})
+        return today.toordinal() - first_day.toordinal()
+
+    def _generate_day(self, con, today: date, tasks: list[Task], assigner: DailyTaskAssigner):
+        self._delete_pending_tasks_on_date(today, con) # Pending tasks today are being deleted to avoid issues while re-running
+        self._mark_as_incompleted_previous_days_pending_tasks(today, con)
+        todays_scheduled_task_ids = self._get_today_scheduled_task_ids(con, today)
+        tasks = self._get_tasks_due_today(con, tasks, today, todays_scheduled_task_ids)
+
+        assignments, unasigned_effort = self.plan_daily_assignments(tasks, assigner)
+        for task, user in assignments:
+            self._schedule_task_for_today(task, today, con, user)
+
+        if unasigned_effort > 0:
+            logger.warn(f"There are a total of {unasigned_effort} effort points not assigned as there is not enough capacity")
+        generationStateRepository.set_last_generated_date(con, today)
+
+    def _generate_missed_days(self, con, today: date) -> date:
+        """Runs on the writer thread, so the missed days are detected and generated without other writes in between.
+        Returns the first generated day, or None if no day was missed"""
+        last_generated_day = generationStateRepository.get_last_generated_date(con)
+        if last_generated_day == None or last_generated_day >= today - timedelta(days=1):
+            return None
+        first_day = last_generated_day + timedelta(days=1)
+        if first_day < today - timedelta(days=MAX_CATCH_UP_DAYS):
+            logger.warning(f"Days from {first_day} were not generated, only the last {MAX_CATCH_UP_DAYS} days will be")
+            first_day = today - timedelta(days=MAX_CATCH_UP_DAYS)
+        logger.info(f"Generating the missed days from {first_day} to {today - timedelta(days=1)}")
 
-    def _get_user_to_assign(self, task, users, used_effort_by_user: dict, date) -> User:
-        for user in users:
-            remaining_user_effort = self._get_remaining_user_effort(date, user, used_effort_by_user[user.id])
-            if task.effort <= remaining_user_effort:
-                return user
-        return None
-
-    def _schedule_task_for_today(self, task, today, todays_scheduled_task_ids, con, user):
-        """Schedule a task for today if it meets the interval criteria. Skip if already scheduled"""
-        if task.task_id in todays_scheduled_task_ids:
-            logger.info(f"Task '{task.name}' is already scheduled for today - Effort: {task.effort}")
-            return False
-        
-        day_of_week = DAY_LOOKUP[today.weekday()]
-        if task.allowed_days != None and day_of_week not in task.allowed_days:
-            logger.debug(f"Task '{task.name}' is not available today ({day_of_week}) - allowed days {str(task.allowed_days)}")
-            return False
-        
-        last_scheduled = scheduledTaskRepository.get_last_scheduled_task(con, task.task_id)
-        if not last_scheduled or (today - last_scheduled.scheduled_date).days >= task.days_interval:
-            new_scheduled_task = ScheduledTask(None, task_id=task.task_id,  user_id=user.id, scheduled_date=today, status=TaskStatus.PENDING)
-            scheduledTaskRepository.insert_scheduled_task(con, new_scheduled_task)
-            logger.info(f"Task '{task.name}' assigned to {user.username} - Effort: {task.effort}")
-            return True
-        logger.debug(f"Task '{task.name}' is not assigned as it has been scheduled recently")
-        return False
+        tasks = configLoaderService.load_tasks_from_yaml()
+        users = usersService.list_users()
+        taskScheduleStateRepository.sync_tasks_config(con, tasks)
+        # The schedule state is kept in memory while replaying the days, and everything is written at the end
+        last_scheduled_dates = taskScheduleStateRepository.get_last_scheduled_dates(con)
+        allowed_days_mask_by_task = {task.task_id: taskScheduleStateRepository.get_allowed_days_mask(task) for task in tasks}
+
+        new_scheduled_tasks = []
+        for ordinal in range(first_day.toordinal(), today.toordinal()):
+            day = date.fromordinal(ordinal)
+            self._random.shuffle(tasks)
+            weekday_bit = 1 << day.weekday()
+            tasks_due = [task for task in tasks if allowed_days_mask_by_task[task.task_id] & weekday_bit
+                         and (task.task_id not in last_scheduled_dates or last_scheduled_dates[task.task_id] + timedelta(days=task.days_interval) <= day)]
+
+            assignments, unasigned_effort = self.plan_daily_assignments(tasks_due, DailyTaskAssigner(users, day, self.assignment_strategy))
+            for task, user in assignments:
+                new_scheduled_tasks.append(ScheduledTask(None, task_id=task.task_id, user_id=user.id, scheduled_date=day, status=TaskStatus.PENDING))
+                last_scheduled_dates[task.task_id] = day
+            logger.info(f"Generated {len(assignments)} tasks on {day}, {unasigned_effort} effort points not assigned")
+
+        scheduledTaskRepository.insert_scheduled_tasks(con, new_scheduled_tasks)
+        generationStateRepository.set_last_generated_date(con, today - timedelta(days=1))
+        return first_day
+
+    def plan_daily_assignments(self, tasks_due: list[Task], assigner: DailyTaskAssigner):
+        """Decide which user takes each due task. Returns the (task, user) assignments and the effort that could not be assigned"""
+        assignments = []
+        # First assign the mandatory tasks (zero effort)
+        for task in tasks_due:
+            if task.effort == 0:
+                user = assigner.assign_mandatory_task(task)
+                if user != None:
+                    assignments.append((task, user))
+
+        # Then the time-consuming tasks
+        unasigned_effort = 0
+        for task in tasks_due:
+            if task.effort == 0:
+                continue
+            user = assigner.assign_task(task)
+            if user != None:
+                assignments.append((task, user))
+            else:
+                unasigned_effort += task.effort
+                logger.debug(f"Task {task.name} cannot be scheduled as there is not effort remaining")
+        return assignments, unasigned_effort
+
+    def _get_tasks_due_today(self, con, tasks, today, todays_scheduled_task_ids):
+        """Keep the tasks (in their current order) whose interval has elapsed and that are allowed today. Skip the ones already scheduled"""
+        taskScheduleStateRepository.sync_tasks_config(con, tasks)
+        due_task_ids = taskScheduleStateRepository.get_due_task_ids(con, today)
+        tasks_due_today = []
+        for task in tasks:
+            if task.task_id in todays_scheduled_task_ids:
+                logger.info(f"Task '{task.name}' is already scheduled for today - Effort: {task.effort}")
+            elif task.task_id in due_task_ids:
+                tasks_due_today.append(task)
+        logger.debug(f"There are {len(tasks_due_today)} tasks due today out of {len(tasks)}")
+        return tasks_due_today
+
+    def _schedule_task_for_today(self, task, today, con, user):
+        new_scheduled_task = ScheduledTask(None, task_id=task.task_id,  user_id=user.id, scheduled_date=today, status=TaskStatus.PENDING)
+        scheduledTaskRepository.insert_scheduled_task(con, new_scheduled_task)
+        logger.info(f"Task '{task.name}' assigned to {user.username} - Effort: {task.effort}")
 
     def _mark_as_incompleted_previous_days_pending_tasks(self, today, con):
         scheduledTaskRepository.update_past_scheduled_tasks_status(con, TaskStatus.PENDING, today, TaskStatus.INCOMPLETE)
@@ -97,19 +162,7 @@ class GenerateTasksService:
         tasks = scheduledTaskRepository.get_scheduled_tasks(con, None, None, today)
         return {task.task_id for task in tasks}
 
-    def _assign_mandatory_tasks(self, tasks, date, users, todays_scheduled_task_ids, con):
-        mandatory_task_ids_assigned = set()
-        current_user_index = 0
-        for task in tasks:
-            if task.effort == 0:  # Mandatory tasks have zero effort
-                self._schedule_task_for_today(task, date, todays_scheduled_task_ids, con, users[current_user_index])
-                mandatory_task_ids_assigned.add(task.task_id)
-                current_user_index += 1 
-            if current_user_index >= len(users):
-                current_user_index = 0
-        return mandatory_task_ids_assigned
-
-    def _log_user_available_efforts(self, today, users):
+    def _log_user_available_efforts(self, assigner: DailyTaskAssigner, users):
         for user in users:
-            available_effort = self._get_remaining_user_effort(today, user, 0)
+            available_effort = assigner.get_available_effort(user)
             logger.info(f"User {user.username} has today an available effort of {str(available_effort)}")
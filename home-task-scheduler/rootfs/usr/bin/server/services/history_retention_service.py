@@ -0,0 +1,50 @@
+from repositories.database_client import open_db_session
+from repositories.scheduled_task_repository import ScheduledTaskRepository
+from services.schedule_changes_service import ScheduleChangesService
+from services.write_queue_service import WriteQueueService
+from common import HISTORY_RETENTION_DAYS
+from datetime import date, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+scheduledTaskRepository = ScheduledTaskRepository()
+scheduleChangesService = ScheduleChangesService()
+writeQueueService = WriteQueueService()
+
+# Each write handles this many days, so other writes don't wait for long
+DAYS_PER_TRANSACTION = 31
+
+class HistoryRetentionService:
+    """Keeps the scheduled tasks history small: old tasks are rolled up into daily aggregates and removed"""
+
+    def __init__(self, retention_days: int = HISTORY_RETENTION_DAYS):
+        self.retention_days = retention_days
+
+    def apply_retention(self, today: date = None):
+        if self.retention_days <= 0:
+            logger.info("History retention is disabled")
+            return
+        if today == None:
+            today = date.today()
+        horizon = today - timedelta(days=self.retention_days)
+
+        removed_tasks = 0
+        with open_db_session() as con:
+            from_date = scheduledTaskRepository.get_first_scheduled_date(con)
+            while from_date != None and from_date < horizon:
+                to_date = min(from_date + timedelta(days=DAYS_PER_TRANSACTION), horizon)
+                removed_tasks += writeQueueService.run(scheduledTaskRepository.roll_up_scheduled_tasks, from_date, to_date)
+                from_date = to_date
+        if removed_tasks > 0:
+            # Give the freed pages back to the file system, on the writer as it takes the write lock
+            writeQueueService.run(self._free_pages, changes_schedule=False)
+            scheduleChangesService.mark_schedule_changed({"type": "history_rolled_up", "before": horizon.isoformat()})
+        logger.info(f"History retention finished, {removed_tasks} scheduled tasks before {horizon} were rolled up")
+
+    def _free_pages(self, con):
+        # Each step of the pragma frees a page, but the sqlite3 module only steps it once (it has no result rows,
+        # so fetchall doesn't step it either). It is run once for each free page instead
+        free_pages = con.execute("PRAGMA freelist_count").fetchone()[0]
+        for _ in range(free_pages):
+            con.execute("PRAGMA incremental_vacuum")
@@ -0,0 +1,175 @@
+from domain import ScheduledTask, TaskStatus
+from model_mapper import scheduledTask_to_json
+from repositories.database_client import open_db_session
+from repositories.scheduled_task_repository import ScheduledTaskRepository, STATUS_BY_VALUE
+from services.schedule_changes_service import ScheduleChangesService
+from services.write_queue_service import WriteQueueService
+from datetime import date
+import csv
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+scheduledTaskRepository = ScheduledTaskRepository()
+scheduleChangesService = ScheduleChangesService()
+writeQueueService = WriteQueueService()
+
+TRANSFER_FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = ["scheduled_task_id", "task_id", "user_id", "scheduled_date", "status"]
+EXPORT_CHUNK_SIZE = 1000
+# Each chunk is a write of its own, so other writes (and the generation) are never kept waiting for long
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 20
+
+class _ReadError(Exception):
+    def __init__(self, cause: Exception):
+        super().__init__(str(cause))
+        self.cause = cause
+
+class HistoryTransferService:
+    """Moves the scheduled tasks history in and out of a household as NDJSON (a JSON object per line) or CSV.
+    The rolled up history of the retention is not included"""
+
+    def export_scheduled_tasks(self, format: str):
+        """Yields the export in text chunks, reading the scheduled tasks as they are written so memory use doesn't grow with the history"""
+        self._check_format(format)
+        cursor = scheduledTaskRepository.get_all_scheduled_tasks(open_db_session())
+        try:
+            if format == "csv":
+                yield ",".join(CSV_COLUMNS) + "\r\n"
+            while True:
+                scheduled_tasks = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not scheduled_tasks:
+                    break
+                if format == "csv":
+                    yield self._to_csv(scheduled_tasks)
+                else:
+                    yield "".join(scheduledTask_to_json(scheduled_task) + "\n" for scheduled_task in scheduled_tasks)
+        finally:
+            cursor.close()
+
+    def import_scheduled_tasks(self, lines, format: str) -> dict:
+        """Adds the scheduled tasks read from lines (any iterable of text lines, like a file) to the current household.
+        They get new ids, following the existing ones, and id_mapping tells the new id of each imported one as
+        runs of consecutive ids. Rows that are not valid are skipped and reported.
+        If the lines can't be read anymore (like an invalid UTF-8 byte) after some chunks were already committed, the import stops
+        and the result tells it on aborted, with the last line of the committed chunks, so it can be resumed without importing them twice.
+        Before that, the error is raised"""
+        self._check_format(format)
+        rows = self._read_csv(lines) if format == "csv" else self._read_ndjson(lines)
+        imported_count = 0
+        rejected_count = 0
+        errors = []
+        id_mapping = []
+        chunk = []
+        line_number = 0
+        committed_line_number = 0
+        aborted = None
+        try:
+            for line_number, row in self._stop_on_read_error(rows):
+                try:
+                    chunk.append(self._parse_scheduled_task(row))
+                except ValueError as error:
+                    rejected_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": line_number, "error": str(error)})
+                    continue
+                if len(chunk) == IMPORT_CHUNK_SIZE:
+                    imported_count += self._import_chunk(chunk, id_mapping)
+                    committed_line_number = line_number
+                    chunk = []
+            if chunk:
+                imported_count += self._import_chunk(chunk, id_mapping)
+        except _ReadError as error:
+            if imported_count == 0:
+                raise error.cause
+            # The rows read after the last committed chunk are not imported, the import can go on after its last line
+            aborted = {"after_line": committed_line_number, "error": str(error.cause)}
+            logger.warning(f"Import aborted after {imported_count} scheduled tasks: {error.cause}")
+        finally:
+            if imported_count > 0:
+                scheduleChangesService.mark_schedule_changed({"type": "scheduled_tasks_imported", "count": imported_count})
+        logger.info(f"Imported {imported_count} scheduled tasks, {rejected_count} rejected")
+        result = {"imported": imported_count, "rejected": rejected_count, "errors": errors, "id_mapping": id_mapping}
+        if aborted != None:
+            result["aborted"] = aborted
+        return result
+
+    def _stop_on_read_error(self, rows):
+        # Tells the errors reading the lines apart from the ones writing the chunks
+        try:
+            yield from rows
+        except (ValueError, csv.Error) as error:
+            raise _ReadError(error)
+
+    def _import_chunk(self, scheduled_tasks: list[ScheduledTask], id_mapping: list[dict]) -> int:
+        first_id = writeQueueService.run(scheduledTaskRepository.insert_scheduled_tasks_with_new_ids, scheduled_tasks)
+        for index, scheduled_task in enumerate(scheduled_tasks):
+            if scheduled_task.scheduled_task_id == None:
+                continue
+            new_id = first_id + index
+            last_run = id_mapping[-1] if id_mapping else None
+            if last_run != None and last_run["from_id"] + last_run["count"] == scheduled_task.scheduled_task_id and last_run["to_id"] + last_run["count"] == new_id:
+                last_run["count"] += 1
+            else:
+                id_mapping.append({"from_id": scheduled_task.scheduled_task_id, "to_id": new_id, "count": 1})
+        return len(scheduled_tasks)
+
+    def _to_csv(self, scheduled_tasks: list[ScheduledTask]) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerows([scheduled_task.scheduled_task_id, scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date.isoformat(),
+                          scheduled_task.status.value] for scheduled_task in scheduled_tasks)
+        return output.getvalue()
+
+    def _read_csv(self, lines):
+        reader = csv.DictReader(lines)
+        missing_columns = [column for column in CSV_COLUMNS[1:] if column not in (reader.fieldnames or [])]
+        if missing_columns:
+            raise ValueError(f"The CSV header is missing the columns {', '.join(missing_columns)}")
+        for row in reader:
+            yield reader.line_num, row
+
+    def _read_ndjson(self, lines):
+        for line_number, line in enumerate(lines, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+    def _parse_scheduled_task(self, row: dict) -> ScheduledTask:
+        if not isinstance(row, dict):
+            raise ValueError("The line is not a JSON object")
+        scheduled_task_id = row.get("scheduled_task_id")
+        return ScheduledTask(None if scheduled_task_id in (None, "") else self._parse_int(scheduled_task_id, "scheduled_task_id"),
+                             self._parse_int(row.get("task_id"), "task_id"),
+                             self._parse_int(row.get("user_id"), "user_id"),
+                             self._parse_date(row.get("scheduled_date")),
+                             self._parse_status(row.get("status")))
+
+    def _parse_int(self, value, field_name: str) -> int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.isdigit():
+            return int(value)
+        raise ValueError(f"The {field_name} must be a number")
+
+    def _parse_date(self, value) -> date:
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError("The scheduled_date must be a date with format YYYY-MM-DD")
+
+    def _parse_status(self, value) -> TaskStatus:
+        status = STATUS_BY_VALUE.get(value) if isinstance(value, str) else None
+        if status == None:
+            raise ValueError("The status is not a valid TaskStatus")
+        return status
+
+    def _check_format(self, format: str):
+        if format not in TRANSFER_FORMATS:
+            raise ValueError(f"The format must be one of {', '.join(TRANSFER_FORMATS)}")
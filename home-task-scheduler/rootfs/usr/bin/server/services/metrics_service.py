@@ -0,0 +1,147 @@
+import threading
+import functools
+
+METRICS_PREFIX = "home_task_scheduler_"
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+GENERATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+WRITE_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+class _Histogram():
+    def __init__(self, name: str, help: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values_by_labels = {} # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        values = self.values_by_labels.get(labels)
+        if values == None:
+            values = self.values_by_labels[labels] = [0] * (len(self.buckets) + 2)
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                values[index] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, values in sorted(self.values_by_labels.items()):
+            for index, bucket in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (str(bucket),))} {values[index]}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + ('+Inf',))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {values[-1]}")
+
+class _Counter():
+    def __init__(self, name: str, help: str, label_names: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values_by_labels = {}
+
+    def increment(self, labels: tuple, amount: float = 1):
+        self.values_by_labels[labels] = self.values_by_labels.get(labels, 0) + amount
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        for labels, value in sorted(self.values_by_labels.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+
+class _Gauge():
+    def __init__(self, name: str, help: str, label_names: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values_by_labels = {}
+
+    def set(self, labels: tuple, value: float):
+        self.values_by_labels[labels] = value
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} gauge")
+        for labels, value in sorted(self.values_by_labels.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+
+def _format_labels(label_names: tuple, labels: tuple) -> str:
+    if not label_names:
+        return ""
+    escaped_values = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped_values)) + "}"
+
+# Shared by every MetricsService instance
+_metrics_lock = threading.Lock()
+_request_duration = _Histogram(METRICS_PREFIX + "http_request_duration_seconds", "Time to handle each request, by route", ("method", "route", "status"), REQUEST_BUCKETS)
+_sql_statements = _Counter(METRICS_PREFIX + "sql_statements_total", "SQL statements executed, by repository method", ("operation",))
+_sql_duration = _Histogram(METRICS_PREFIX + "sql_statement_duration_seconds", "Time to execute each SQL statement, by repository method", ("operation",), SQL_BUCKETS)
+_config_load_duration = _Histogram(METRICS_PREFIX + "config_load_duration_seconds", "Time to read and parse a config file (only done when it changes)", ("file",), SQL_BUCKETS + (2.5, 5))
+_generation_duration = _Histogram(METRICS_PREFIX + "generation_duration_seconds", "Duration of the daily tasks generation runs, by trigger and outcome", ("trigger", "outcome"), GENERATION_BUCKETS)
+_generation_last_run = _Gauge(METRICS_PREFIX + "generation_last_run_timestamp_seconds", "Unix time in which the last generation run finished, by trigger and outcome", ("trigger", "outcome"))
+_write_batch_size = _Histogram(METRICS_PREFIX + "write_batch_size", "Writes committed together on each transaction of the writer thread", (), WRITE_BATCH_BUCKETS)
+_push_requests = _Counter(METRICS_PREFIX + "push_requests_total", "Requests pushing notifications to Home Assistant, by outcome", ("outcome",))
+_pushed_notifications = _Counter(METRICS_PREFIX + "pushed_notifications_total", "Notifications sent on the push requests (several are batched on one request), by outcome", ("outcome",))
+ALL_METRICS = (_request_duration, _sql_statements, _sql_duration, _config_load_duration, _generation_duration, _generation_last_run, _write_batch_size,
+               _push_requests, _pushed_notifications)
+
+# Repository method running on each thread, the SQL statements are accounted to it
+_current_operation = threading.local()
+
+class MetricsService:
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        with _metrics_lock:
+            _request_duration.observe((method, route, str(status)), seconds)
+
+    def observe_sql_statement(self, seconds: float):
+        labels = (getattr(_current_operation, "name", None) or "other",)
+        with _metrics_lock:
+            _sql_statements.increment(labels)
+            _sql_duration.observe(labels, seconds)
+
+    def observe_config_load(self, file_path: str, seconds: float):
+        with _metrics_lock:
+            _config_load_duration.observe((file_path,), seconds)
+
+    def observe_generation_run(self, trigger: str, outcome: str, seconds: float, finished_at: float):
+        with _metrics_lock:
+            _generation_duration.observe((trigger, outcome), seconds)
+            _generation_last_run.set((trigger, outcome), finished_at)
+
+    def observe_write_batch(self, size: int):
+        with _metrics_lock:
+            _write_batch_size.observe((), size)
+
+    def observe_push(self, outcome: str, notification_count: int):
+        with _metrics_lock:
+            _push_requests.increment((outcome,))
+            _pushed_notifications.increment((outcome,), notification_count)
+
+    def render(self) -> str:
+        """Returns every metric on the Prometheus text exposition format"""
+        lines = []
+        with _metrics_lock:
+            for metric in ALL_METRICS:
+                metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+def instrument_repository(repository_class):
+    """Class decorator, accounts the SQL statements run by each public method to '<class>.<method>'"""
+    for attribute_name, attribute in list(vars(repository_class).items()):
+        if callable(attribute) and not attribute_name.startswith("_"):
+            setattr(repository_class, attribute_name, _with_operation_name(f"{repository_class.__name__}.{attribute_name}", attribute))
+    return repository_class
+
+def _with_operation_name(operation_name: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        previous_name = getattr(_current_operation, "name", None)
+        _current_operation.name = operation_name
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _current_operation.name = previous_name
+    return wrapper
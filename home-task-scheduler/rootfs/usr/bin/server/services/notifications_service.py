@@ -1,9 +1,10 @@
 from domain import ScheduledTask, TaskStatus, Notification
 from services.config_loader_service import ConfigLoaderService
 from services.users_service import UsersService
-from repositories.scheduled_task_repository import ScheduledTaskRepository
+from services.schedule_changes_service import DerivedStateCache
+from services.today_schedule_service import TodayScheduleService
 
-scheduledTaskRepository = ScheduledTaskRepository()
+todayScheduleService = TodayScheduleService()
 configLoaderService = ConfigLoaderService()
 usersService = UsersService()
 
@@ -15,43 +16,41 @@ YOUR_TASKS_ARE_MSG_BY_LANGUAGE = {
 
 class NotificationService:
 
-    def get_notification_message(self, con, language: str):
-        notification_available = False
-        notification_message = ""
+    def __init__(self):
+        # Notifications by language, the message only changes when the scheduled tasks, the config files or the current day change
+        self._cache = DerivedStateCache()
 
-        your_tasks_message = self._get_your_tasks_message(language)
-        users = usersService.list_users()
-        for user in users:
-            user_notification = self._generate_task_message_for_user(con, user.id)
-            if user_notification.notification_available:
-                notification_available = True
-                notification_message += f"\n{user.username}, {your_tasks_message}: {user_notification.notification_message}."
-
-        if not notification_available:
-            return Notification(notification_available, "No notifications")
-        return Notification(notification_available, notification_message)
-    
-    def _get_your_tasks_message(self, language: str):
+    def get_notification_message(self, language: str):
         if language == None:
             language = DEFAULT_LANGUAGE
+        your_tasks_message = self._get_your_tasks_message(language)
+        return self._cache.get(language, lambda: self._build_notification(your_tasks_message))
 
+    def _build_notification(self, your_tasks_message: str):
+        pending_tasks_today = todayScheduleService.get_today_tasks(TaskStatus.PENDING.to_string())
+        tasks_by_user = self._group_by_user(pending_tasks_today)
+        tasks_by_id = configLoaderService.load_tasks_from_yaml_as_id_dictionary()
+
+        notification_message = ""
+        for user in usersService.list_users():
+            if user.id in tasks_by_user:
+                task_names_str = ", ".join(self._fetch_tasks_names(tasks_by_user[user.id], tasks_by_id))
+                notification_message += f"\n{user.username}, {your_tasks_message}: {task_names_str}."
+
+        if notification_message == "":
+            return Notification(False, "No notifications")
+        return Notification(True, notification_message)
+
+    def _get_your_tasks_message(self, language: str):
         if language not in YOUR_TASKS_ARE_MSG_BY_LANGUAGE:
             raise ValueError(f"Language {language} is not supported")
         return YOUR_TASKS_ARE_MSG_BY_LANGUAGE[language]
-    
-    def _generate_task_message_for_user(self, con, user_id: int):
-        tasks_today = scheduledTaskRepository.get_today_scheduled_tasks_by_status_and_user(con, TaskStatus.PENDING.to_string(), user_id)
-        notification_available = len(tasks_today) > 0
-        if not notification_available:
-            return Notification(notification_available, "No notifications")
-        
-        task_names = self._fetch_tasks_names(tasks_today)
-        task_names_str = ", ".join(map(lambda task_name: str(task_name), task_names))
-        return Notification(notification_available, task_names_str)
-    
-    def _fetch_tasks_names(self, scheduled_tasks: ScheduledTask):
-        tasks_by_id = configLoaderService.load_tasks_from_yaml_as_id_dictionary()
-        task_names = []
+
+    def _group_by_user(self, scheduled_tasks: list[ScheduledTask]) -> dict:
+        tasks_by_user = {}
         for scheduled_task in scheduled_tasks:
-            task_names.append(tasks_by_id[scheduled_task.task_id].name)
-        return task_names
\ No newline at end of file
+            tasks_by_user.setdefault(scheduled_task.user_id, []).append(scheduled_task)
+        return tasks_by_user
+
+    def _fetch_tasks_names(self, scheduled_tasks: list[ScheduledTask], tasks_by_id: dict) -> list[str]:
+        return [str(tasks_by_id[scheduled_task.task_id].name) for scheduled_task in scheduled_tasks]
@@ -0,0 +1,204 @@
+from common import PUSH_URL, PUSH_TOKEN, PUSH_LANGUAGE
+from household_context import Household, use_household
+from repositories.database_client import open_db_session
+from repositories.push_outbox_repository import PushOutboxRepository
+from services.metrics_service import MetricsService
+from services.notifications_service import NotificationService
+from services.schedule_changes_service import ScheduleChangesService
+from services.write_queue_service import WriteQueueService
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+pushOutboxRepository = PushOutboxRepository()
+notificationService = NotificationService()
+scheduleChangesService = ScheduleChangesService()
+writeQueueService = WriteQueueService()
+metricsService = MetricsService()
+
+# Only the changes that may change the notification of today are pushed
+PUSHED_EVENT_TYPES = {"tasks_generated", "scheduled_task_updated", "scheduled_tasks_updated", "user_tasks_updated", "scheduled_tasks_imported"}
+BATCH_DELAY_SECONDS = 1 # Changes come in bursts (a generation, several status updates), they are pushed together
+MAX_OUTBOX_SIZE = 1000
+MAX_BATCH_SIZE = 50
+MIN_RETRY_DELAY_SECONDS = 2
+MAX_RETRY_DELAY_SECONDS = 300
+ERROR_DELAY_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 10
+MAX_IDLE_CONNECTIONS = 2
+
+# Outcomes of a push request
+DELIVERED = "delivered"
+RETRY = "retry"
+REJECTED = "rejected"
+
+class _HttpConnectionPool():
+    """Keep-alive connections to the push endpoint, so each push doesn't pay a new TCP (and TLS) handshake"""
+
+    def __init__(self, url: str, max_idle_connections: int):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Push URL {url} is not a valid http or https URL")
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self.max_idle_connections = max_idle_connections
+        self._idle_connections = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns a connection and whether it was already used, as the server may have closed it in the meantime"""
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop(), True
+        return self.connect(), False
+
+    def connect(self):
+        return self.connection_class(self.host, self.port, timeout=REQUEST_TIMEOUT_SECONDS)
+
+    def release(self, connection, response: http.client.HTTPResponse):
+        if not response.will_close:
+            with self._lock:
+                if len(self._idle_connections) < self.max_idle_connections:
+                    self._idle_connections.append(connection)
+                    return
+        connection.close()
+
+class PushService:
+    """Pushes the notification of today to Home Assistant every time the schedule changes, instead of waiting for it to be pulled.
+    Notifications go first to an outbox on the database, so the ones not delivered yet are sent after a restart"""
+
+    def __init__(self, url: str = PUSH_URL, token: str = PUSH_TOKEN, language: str = PUSH_LANGUAGE):
+        self.url = url
+        self.token = token
+        self.language = language
+        self._connection_pool = None
+
+    def is_enabled(self) -> bool:
+        return self.url != ""
+
+    def configure(self) -> bool:
+        """Checks the push URL once, before starting any household. Pushing is turned off if it is not valid, so a typo
+        doesn't stop the households from starting. Returns whether pushing is enabled"""
+        if not self.is_enabled():
+            return False
+        if self._connection_pool == None:
+            try:
+                self._connection_pool = _HttpConnectionPool(self.url, MAX_IDLE_CONNECTIONS)
+            except ValueError as error:
+                logger.error(f"{error}, the notifications will not be pushed")
+                self.url = ""
+                return False
+        return True
+
+    def start(self, household: Household):
+        """Starts pushing the changes of the household from now on, and whatever was left on its outbox"""
+        if not self.configure():
+            return
+        # Subscribe right away, so the changes committed while the thread starts are not missed
+        with use_household(household):
+            since_version = scheduleChangesService.get_schedule_version()
+        threading.Thread(target=self._run, args=[household, since_version], name=f"push-{household.name}", daemon=True).start()
+        logger.info(f"Pushing the notifications of household {household.name} to {self.url}")
+
+    def _run(self, household: Household, since_version: int):
+        with use_household(household):
+            while True:
+                try:
+                    version, _, _ = scheduleChangesService.wait_for_events(since_version, self._get_seconds_to_next_delivery())
+                    if version > since_version:
+                        time.sleep(BATCH_DELAY_SECONDS)
+                        version, events, missed_events = scheduleChangesService.wait_for_events(since_version, 0)
+                        since_version = version
+                        pushed_events = [event for _, event in events if event["type"] in PUSHED_EVENT_TYPES]
+                        if pushed_events or missed_events:
+                            self._add_to_outbox(household, pushed_events)
+                    self._deliver_due_notifications()
+                except Exception:
+                    logger.exception(f"Pushing the notifications of household {household.name} failed")
+                    time.sleep(ERROR_DELAY_SECONDS)
+
+    def _get_seconds_to_next_delivery(self) -> float:
+        next_attempt_at = pushOutboxRepository.get_next_attempt_at(open_db_session())
+        if next_attempt_at == None:
+            return None
+        return max(0, next_attempt_at - time.time())
+
+    def _add_to_outbox(self, household: Household, events: list[dict]):
+        notification = notificationService.get_notification_message(self.language)
+        payload = json.dumps({
+            "household": household.name,
+            "notification_available": notification.notification_available,
+            "notification_message": notification.notification_message,
+            "events": events,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+        dropped_count = writeQueueService.run(pushOutboxRepository.add, payload, time.time(), MAX_OUTBOX_SIZE, changes_schedule=False)
+        if dropped_count > 0:
+            logger.warning(f"The push outbox is full, {dropped_count} notifications were dropped")
+
+    def _deliver_due_notifications(self):
+        # Sent in order: while the oldest notification is waiting to be retried, the newer ones wait too
+        while True:
+            con = open_db_session()
+            next_attempt_at = pushOutboxRepository.get_next_attempt_at(con)
+            if next_attempt_at == None or next_attempt_at > time.time():
+                return
+            rows = pushOutboxRepository.get_oldest(con, MAX_BATCH_SIZE)
+            outbox_ids = [row[0] for row in rows]
+            outcome = self._send(self._build_batch_body([json.loads(row[1]) for row in rows]))
+            metricsService.observe_push(outcome, len(rows))
+            if outcome == RETRY:
+                attempts = max(row[2] for row in rows)
+                retry_delay = min(MAX_RETRY_DELAY_SECONDS, MIN_RETRY_DELAY_SECONDS * 2 ** attempts) * random.uniform(0.5, 1)
+                writeQueueService.run(pushOutboxRepository.mark_failed, outbox_ids, time.time() + retry_delay, changes_schedule=False)
+                return
+            writeQueueService.run(pushOutboxRepository.delete, outbox_ids, changes_schedule=False)
+
+    def _build_batch_body(self, payloads: list[dict]) -> bytes:
+        # Only the latest notification matters, the events of the whole batch are kept
+        body = dict(payloads[-1])
+        body["events"] = [event for payload in payloads for event in payload["events"]]
+        return json.dumps(body).encode("utf-8")
+
+    def _send(self, body: bytes) -> str:
+        headers = {"Content-Type": "application/json"}
+        if self.token != "":
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        connection, reused = self._connection_pool.acquire()
+        while True:
+            try:
+                response = self._post(connection, body, headers)
+                break
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                if not reused:
+                    logger.warning(f"Pushing to {self.url} failed: {error!r}")
+                    return RETRY
+                # The server may have closed the idle connection, try once more on a new one
+                connection, reused = self._connection_pool.connect(), False
+        self._connection_pool.release(connection, response)
+
+        if 200 <= response.status < 300:
+            return DELIVERED
+        if response.status in (408, 429) or response.status >= 500:
+            logger.warning(f"Pushing to {self.url} answered {response.status}, it will be retried")
+            return RETRY
+        # Sending it again would get the same answer
+        logger.error(f"Pushing to {self.url} answered {response.status}, the notifications are discarded")
+        return REJECTED
+
+    def _post(self, connection, body: bytes, headers: dict) -> http.client.HTTPResponse:
+        connection.request("POST", self._connection_pool.path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read() # The connection can only be reused once the response is fully read
+        return response
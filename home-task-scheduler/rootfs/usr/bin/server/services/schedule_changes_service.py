@@ -0,0 +1,120 @@
+from collections import deque
+from household_context import get_current_household
+from services.config_loader_service import ConfigLoaderService
+from datetime import date
+import threading
+import time
+import uuid
+
+configLoaderService = ConfigLoaderService()
+
+MAX_BUFFERED_EVENTS = 500
+
+class _HouseholdScheduleChanges():
+    def __init__(self):
+        # Incremented every time a change on the scheduled tasks is committed
+        self.version = 0
+        self.last_changed_at = time.time()
+        # Last published events as (version, event), so subscribers that fall behind can catch up
+        self.events = deque(maxlen=MAX_BUFFERED_EVENTS)
+        self.condition = threading.Condition()
+
+# Shared by every instance, one per household
+_changes_by_household = {}
+_changes_lock = threading.Lock()
+
+# Versions restart on every run, so they are only meaningful together with this token
+PROCESS_TOKEN = uuid.uuid4().hex[:12]
+
+def _get_changes() -> _HouseholdScheduleChanges:
+    household_name = get_current_household().name
+    changes = _changes_by_household.get(household_name)
+    if changes == None:
+        with _changes_lock:
+            changes = _changes_by_household.setdefault(household_name, _HouseholdScheduleChanges())
+    return changes
+
+class ScheduleChangesService:
+    """In process publish/subscribe hub for the changes on the scheduled tasks of the current household"""
+
+    def get_schedule_version(self) -> int:
+        return _get_changes().version
+
+    def get_schedule_validator(self) -> str:
+        """Identifies the current state of the scheduled tasks, also across restarts. Also used as event cursor"""
+        return self.format_cursor(_get_changes().version)
+
+    def get_last_changed_at(self) -> float:
+        return _get_changes().last_changed_at
+
+    def get_derived_state_key(self) -> tuple:
+        """Identifies everything the views built from the scheduled tasks and the config files (like the notification or the forecast)
+        depend on: the current day, the scheduled tasks and the config files. Also valid as ETag validator"""
+        return (date.today(),
+                self.get_schedule_validator(),
+                configLoaderService.get_config_signature(configLoaderService.get_tasks_config_path()),
+                configLoaderService.get_config_signature(configLoaderService.get_users_config_path()))
+
+    def mark_schedule_changed(self, event: dict = None) -> int:
+        """Must be called after committing any change on the scheduled tasks, so derived caches get invalidated and subscribers notified"""
+        changes = _get_changes()
+        with changes.condition:
+            changes.version += 1
+            changes.last_changed_at = time.time()
+            changes.events.append((changes.version, event if event != None else {"type": "schedule_changed"}))
+            changes.condition.notify_all()
+            return changes.version
+
+    def format_cursor(self, version: int) -> str:
+        return f"{self._get_cursor_token()}-{version}"
+
+    def parse_cursor(self, cursor: str) -> int:
+        """Returns the version of a cursor given by get_schedule_validator, or None if it belongs to another run, another household or is not valid"""
+        if cursor == None:
+            return None
+        token, _, version = cursor.rpartition("-")
+        if token != self._get_cursor_token() or not version.isdigit():
+            return None
+        return int(version)
+
+    def wait_for_events(self, since_version: int, timeout: float):
+        """Wait up to timeout seconds for events newer than since_version.
+        Returns the current version, the new (version, event) pairs and whether some events were already discarded"""
+        changes = _get_changes()
+        with changes.condition:
+            changes.condition.wait_for(lambda: changes.version > since_version, timeout)
+            events = [(version, event) for version, event in changes.events if version > since_version]
+            oldest_buffered_version = changes.events[0][0] if changes.events else changes.version + 1
+            missed_events = oldest_buffered_version > since_version + 1 and changes.version > since_version
+            return changes.version, events, missed_events
+
+    def _get_cursor_token(self) -> str:
+        return f"{PROCESS_TOKEN}.{get_current_household().name}"
+
+class DerivedStateCache():
+    """Values built from the scheduled tasks and the config files of each household, by item (like a language or a number of days).
+    They are kept until the state key of ScheduleChangesService.get_derived_state_key changes"""
+
+    def __init__(self):
+        # As (state key, values by item) for each household
+        self._caches_by_household = {}
+        self._lock = threading.Lock()
+
+    def get(self, item, build):
+        """Returns the cached value of the item for the current household, or the one returned by build() after caching it"""
+        household_name = get_current_household().name
+        state_key = ScheduleChangesService().get_derived_state_key()
+        with self._lock:
+            cached_state_key, values_by_item = self._caches_by_household.get(household_name, (None, {}))
+            if cached_state_key == state_key and item in values_by_item:
+                return values_by_item[item]
+
+        # Built without the lock, so slow builds don't hold back the other households
+        value = build()
+        with self._lock:
+            cached_state_key, values_by_item = self._caches_by_household.get(household_name, (None, {}))
+            if cached_state_key != state_key:
+                values_by_item = {}
+                self._caches_by_household[household_name] = (state_key, values_by_item)
+            values_by_item[item] = value
+        return value
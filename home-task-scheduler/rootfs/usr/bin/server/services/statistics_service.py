@@ -0,0 +1,71 @@
+from domain import TaskStatus
+from services.config_loader_service import ConfigLoaderService
+from repositories.database_client import open_db_session
+from repositories.scheduled_task_stats_repository import ScheduledTaskStatsRepository
+from datetime import date
+
+configLoaderService = ConfigLoaderService()
+scheduledTaskStatsRepository = ScheduledTaskStatsRepository()
+
+class StatisticsService:
+    """Completion statistics by user and by task, read from the counters kept by ScheduledTaskStatsRepository"""
+
+    def get_statistics(self, today: date = None) -> dict:
+        if today == None:
+            today = date.today()
+        tasks_by_id = configLoaderService.load_tasks_from_yaml_as_id_dictionary()
+        users_by_id = configLoaderService.load_users_by_id_from_yaml()
+
+        counts_by_user = {user_id: self._new_counts() for user_id in users_by_id}
+        counts_by_task = {task_id: self._new_counts() for task_id in tasks_by_id}
+        with open_db_session() as con:
+            for user_id, task_id, status, task_count in scheduledTaskStatsRepository.get_task_counts(con):
+                # Tasks removed from the config still count, but they don't deliver any effort
+                effort = tasks_by_id[task_id].effort if task_id in tasks_by_id else 0
+                for counts in (counts_by_user.setdefault(user_id, self._new_counts()), counts_by_task.setdefault(task_id, self._new_counts())):
+                    counts[status] += task_count
+                    if status == TaskStatus.COMPLETED.value:
+                        counts["effort_delivered"] += effort * task_count
+            streak_by_user = {user_id: self._get_current_streak(con, user_id, today) for user_id in counts_by_user}
+
+        users = []
+        for user_id, counts in sorted(counts_by_user.items()):
+            user = users_by_id.get(user_id)
+            users.append({"user_id": user_id, "username": user.username if user != None else None, **self._to_statistics(counts), "current_streak": streak_by_user[user_id]})
+        tasks = []
+        for task_id, counts in sorted(counts_by_task.items()):
+            task = tasks_by_id.get(task_id)
+            tasks.append({"task_id": task_id, "name": task.name if task != None else None, **self._to_statistics(counts)})
+        return {"users": users, "tasks": tasks}
+
+    def _get_current_streak(self, con, user_id: int, today: date) -> int:
+        """Consecutive days, up to today, on which the user completed all the assigned tasks. Days without tasks don't break it"""
+        streak = 0
+        for scheduled_date, task_count, completed_count in scheduledTaskStatsRepository.get_daily_counts_backwards(con, user_id, today):
+            if task_count <= 0:
+                continue
+            if completed_count < task_count:
+                # Today is not over, its tasks can still be completed
+                if scheduled_date == today.toordinal():
+                    continue
+                break
+            streak += 1
+        return streak
+
+    def _new_counts(self) -> dict:
+        counts = {status.value: 0 for status in TaskStatus}
+        counts["effort_delivered"] = 0
+        return counts
+
+    def _to_statistics(self, counts: dict) -> dict:
+        completed = counts[TaskStatus.COMPLETED.value]
+        finished = completed + counts[TaskStatus.INCOMPLETE.value]
+        return {
+            "scheduled": sum(counts[status.value] for status in TaskStatus),
+            "completed": completed,
+            "incomplete": counts[TaskStatus.INCOMPLETE.value],
+            "pending": counts[TaskStatus.PENDING.value],
+            # Pending tasks are left out, they can still be completed
+            "completion_rate": round(completed / finished, 4) if finished > 0 else None,
+            "effort_delivered": counts["effort_delivered"],
+        }
@@ -0,0 +1,81 @@
+from enum import Enum
+from bisect import bisect_left, insort
+from datetime import date
+from domain import Task, User, DAY_LOOKUP
+import heapq
+
+class AssignmentStrategy(Enum):
+    LEAST_LOADED = "least_loaded" # The user with the most remaining effort gets the task
+    BEST_FIT = "best_fit" # The user with the least remaining effort that can still take the task gets it
+    FIRST_FIT = "first_fit" # The first user (in config order) that can take the task gets it
+
+class _LeastLoadedPool:
+    # Max-heap (stored negated) of (remaining effort, user position, user id)
+    def __init__(self, entries):
+        self._heap = [(-remaining, position, user_id) for remaining, position, user_id in entries]
+        heapq.heapify(self._heap)
+
+    def take(self, effort: int):
+        if not self._heap or -self._heap[0][0] < effort:
+            return None # Not even the least loaded user can take it
+        remaining, position, user_id = self._heap[0]
+        heapq.heapreplace(self._heap, (remaining + effort, position, user_id))
+        return user_id
+
+class _BestFitPool:
+    # Sorted list of (remaining effort, user position, user id)
+    def __init__(self, entries):
+        self._entries = sorted(entries)
+
+    def take(self, effort: int):
+        index = bisect_left(self._entries, (effort, -1, None))
+        if index >= len(self._entries):
+            return None
+        remaining, position, user_id = self._entries.pop(index)
+        insort(self._entries, (remaining - effort, position, user_id))
+        return user_id
+
+class _FirstFitPool:
+    def __init__(self, entries):
+        self._entries = [[remaining, user_id] for remaining, position, user_id in entries]
+
+    def take(self, effort: int):
+        for entry in self._entries:
+            if effort <= entry[0]:
+                entry[0] -= effort
+                return entry[1]
+        return None
+
+POOLS_BY_STRATEGY = {
+    AssignmentStrategy.LEAST_LOADED: _LeastLoadedPool,
+    AssignmentStrategy.BEST_FIT: _BestFitPool,
+    AssignmentStrategy.FIRST_FIT: _FirstFitPool,
+}
+
+class DailyTaskAssigner:
+    """Assigns the tasks of a single day to the users, keeping track of the effort each one has left"""
+
+    def __init__(self, users: list[User], day: date, strategy: AssignmentStrategy = AssignmentStrategy.LEAST_LOADED):
+        self._users_by_id = {user.id: user for user in users}
+        self._day_name = DAY_LOOKUP[day.weekday()]
+        entries = [(self.get_available_effort(user), position, user.id) for position, user in enumerate(users)]
+        self._pool = POOLS_BY_STRATEGY[strategy](entries)
+        # Mandatory tasks are spread evenly, the user with less of them assigned gets the next one
+        self._mandatory_heap = [(0, position, user.id) for position, user in enumerate(users)]
+
+    def get_available_effort(self, user: User) -> int:
+        return user.available_daily_effort[self._day_name]
+
+    def assign_mandatory_task(self, task: Task) -> User:
+        if not self._mandatory_heap:
+            return None
+        assigned_count, position, user_id = self._mandatory_heap[0]
+        heapq.heapreplace(self._mandatory_heap, (assigned_count + 1, position, user_id))
+        return self._users_by_id[user_id]
+
+    def assign_task(self, task: Task) -> User:
+        """Returns the user that takes the task, or None if nobody has enough effort left"""
+        user_id = self._pool.take(task.effort)
+        if user_id == None:
+            return None
+        return self._users_by_id[user_id]
@@ -0,0 +1,121 @@
+from domain import ScheduledTask, TaskStatus
+from household_context import get_current_household
+from repositories.database_client import open_db_session
+from repositories.scheduled_task_repository import ScheduledTaskRepository
+from services.write_queue_service import WriteQueueService
+from datetime import date
+import threading
+
+scheduledTaskRepository = ScheduledTaskRepository()
+writeQueueService = WriteQueueService()
+
+class _TodaySchedule():
+    """Scheduled tasks of a day (any status) and pending tasks (any day), as they were after the write with the given commit sequence"""
+    __slots__ = ("day", "commit_sequence", "tasks_by_id", "today_ids_by_status", "pending_ids_by_user")
+
+    def __init__(self, day: date, commit_sequence: int, scheduled_tasks: list[ScheduledTask]):
+        self.day = day
+        self.commit_sequence = commit_sequence
+        self.tasks_by_id = {}
+        self.today_ids_by_status = {}
+        self.pending_ids_by_user = {}
+        for scheduled_task in scheduled_tasks:
+            self.add(scheduled_task)
+
+    def add(self, scheduled_task: ScheduledTask):
+        self.tasks_by_id[scheduled_task.scheduled_task_id] = scheduled_task
+        if scheduled_task.scheduled_date == self.day:
+            self.today_ids_by_status.setdefault(scheduled_task.status.value, set()).add(scheduled_task.scheduled_task_id)
+        if scheduled_task.status == TaskStatus.PENDING:
+            self.pending_ids_by_user.setdefault(scheduled_task.user_id, set()).add(scheduled_task.scheduled_task_id)
+
+    def remove(self, scheduled_task: ScheduledTask):
+        del self.tasks_by_id[scheduled_task.scheduled_task_id]
+        if scheduled_task.scheduled_date == self.day:
+            self.today_ids_by_status[scheduled_task.status.value].discard(scheduled_task.scheduled_task_id)
+        if scheduled_task.status == TaskStatus.PENDING:
+            self.pending_ids_by_user[scheduled_task.user_id].discard(scheduled_task.scheduled_task_id)
+
+    def change_status(self, scheduled_task: ScheduledTask, to_status: TaskStatus):
+        self.remove(scheduled_task)
+        # Tasks of other days are only kept while pending
+        if scheduled_task.scheduled_date == self.day or to_status == TaskStatus.PENDING:
+            self.add(ScheduledTask(scheduled_task.scheduled_task_id, scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date, to_status))
+
+    def get_tasks(self, scheduled_task_ids) -> list[ScheduledTask]:
+        scheduled_tasks = [self.tasks_by_id[scheduled_task_id] for scheduled_task_id in scheduled_task_ids]
+        scheduled_tasks.sort(key=lambda scheduled_task: (scheduled_task.scheduled_date, scheduled_task.scheduled_task_id))
+        return scheduled_tasks
+
+# Shared by every TodayScheduleService instance, one per household
+_schedules_by_household = {}
+_schedules_lock = threading.Lock()
+
+class TodayScheduleService:
+    """In memory copy of the scheduled tasks of today and of the pending ones, so the most requested reads don't touch the database.
+    The status updates write it through, after any other write it is loaded again on the next read"""
+
+    def get_today_tasks(self, status: str = None) -> list[ScheduledTask]:
+        schedule = self._get_schedule()
+        with _schedules_lock:
+            if status == None:
+                return schedule.get_tasks([scheduled_task_id for scheduled_task_ids in schedule.today_ids_by_status.values() for scheduled_task_id in scheduled_task_ids])
+            return schedule.get_tasks(schedule.today_ids_by_status.get(status, ()))
+
+    def get_pending_tasks_for_user(self, user_id: int) -> list[ScheduledTask]:
+        schedule = self._get_schedule()
+        with _schedules_lock:
+            return schedule.get_tasks(schedule.pending_ids_by_user.get(user_id, ()))
+
+    def load(self):
+        self._get_schedule()
+
+    def update_scheduled_task_status(self, con, scheduled_task_id: int, to_status: TaskStatus):
+        """Write for the WriteQueueService, same as the one of ScheduledTaskRepository"""
+        scheduledTaskRepository.update_scheduled_task_status(con, scheduled_task_id, to_status)
+        scheduled_task = scheduledTaskRepository.get_scheduled_task(con, scheduled_task_id)
+        household_name = get_current_household().name
+        writeQueueService.after_commit(lambda sequence: self._write_through(household_name, sequence, [scheduled_task] if scheduled_task else [], to_status))
+
+    def update_tasks_status_for_user(self, con, user_id: int, from_status: TaskStatus, to_status: TaskStatus):
+        """Write for the WriteQueueService, same as the one of ScheduledTaskRepository"""
+        # Only the tasks being changed are needed, the status they had doesn't matter on the cache
+        scheduled_tasks = scheduledTaskRepository.get_tasks_for_user(con, user_id, from_status)
+        scheduledTaskRepository.update_tasks_status_for_user(con, user_id, from_status, to_status)
+        household_name = get_current_household().name
+        writeQueueService.after_commit(lambda sequence: self._write_through(household_name, sequence, scheduled_tasks, to_status))
+
+    def _write_through(self, household_name: str, sequence: int, scheduled_tasks: list[ScheduledTask], to_status: TaskStatus):
+        with _schedules_lock:
+            schedule = _schedules_by_household.get(household_name)
+            # Only a schedule with every previous write applied can take this one, otherwise it is loaded again anyway
+            if schedule == None or schedule.commit_sequence != sequence - 1:
+                return
+            for scheduled_task in scheduled_tasks:
+                cached_task = schedule.tasks_by_id.get(scheduled_task.scheduled_task_id)
+                if cached_task != None:
+                    schedule.change_status(cached_task, to_status)
+                elif scheduled_task.scheduled_date == schedule.day or to_status == TaskStatus.PENDING:
+                    schedule.add(ScheduledTask(scheduled_task.scheduled_task_id, scheduled_task.task_id, scheduled_task.user_id, scheduled_task.scheduled_date, to_status))
+            schedule.commit_sequence = sequence
+
+    def _get_schedule(self) -> _TodaySchedule:
+        # The schedule may still be changed by the write through, read it holding the lock
+        household_name = get_current_household().name
+        today = date.today()
+        commit_sequence = writeQueueService.get_commit_sequence()
+        with _schedules_lock:
+            schedule = _schedules_by_household.get(household_name)
+            if schedule != None and schedule.day == today and schedule.commit_sequence >= commit_sequence:
+                return schedule
+
+        # Loaded without the lock, so the other readers and the write through of the writer thread never wait for the database.
+        # Any write after reading the sequence may be included too, applying it again later does no harm
+        scheduled_tasks = scheduledTaskRepository.get_scheduled_tasks_on_date_or_pending(open_db_session(), today)
+        loaded_schedule = _TodaySchedule(today, commit_sequence, scheduled_tasks)
+        with _schedules_lock:
+            schedule = _schedules_by_household.get(household_name)
+            # Compare and set, a schedule loaded (or written through) up to a later write while this one was loading is kept
+            if schedule == None or schedule.day != today or schedule.commit_sequence < commit_sequence:
+                schedule = _schedules_by_household[household_name] = loaded_schedule
+            return schedule
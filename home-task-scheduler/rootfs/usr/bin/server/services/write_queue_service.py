@@ -0,0 +1,155 @@
+from concurrent.futures import Future
+from household_context import get_current_household, use_household
+from repositories.database_client import open_writer_session
+from services.metrics_service import MetricsService
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+metricsService = MetricsService()
+
+WRITE_QUEUE_SIZE = 256
+MAX_WRITES_PER_TRANSACTION = 64
+SUBMIT_TIMEOUT_SECONDS = 30
+WRITE_TIMEOUT_SECONDS = 120
+
+class _Write():
+    __slots__ = ("household", "function", "args", "future", "changes_schedule", "after_commit_callbacks")
+
+    def __init__(self, household, function, args, future, changes_schedule):
+        self.household = household
+        self.function = function
+        self.args = args
+        self.future = future
+        self.changes_schedule = changes_schedule
+        self.after_commit_callbacks = []
+
+# Shared by every instance, so there is a single writer for the whole process
+_writes = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+_writer_thread = None
+_writer_lock = threading.Lock()
+# Write being run by the writer thread
+_running_write = None
+# Writes that may have changed the scheduled tasks committed on each household since the start, only changed by the writer thread
+_commit_sequences_by_household = {}
+
+class WriteQueueService:
+    """Runs every change on the scheduled tasks on a single writer thread, so writers never fight for the SQLite write lock.
+    Writes queued together are committed on a single transaction, which also saves the cost of the commits"""
+
+    def submit(self, function, *args, changes_schedule: bool = True) -> Future:
+        """function(con, *args) will run on the writer thread, for the current household, inside a transaction that may be
+        shared with other writes, so it must not commit. The future gets its result (or exception) once it is committed.
+        Writes that never change the scheduled tasks pass changes_schedule=False, so they don't move the commit sequence"""
+        self._start_writer()
+        future = Future()
+        try:
+            _writes.put(_Write(get_current_household(), function, args, future, changes_schedule), timeout=SUBMIT_TIMEOUT_SECONDS)
+        except queue.Full:
+            raise RuntimeError("There are too many pending writes on the database")
+        return future
+
+    def run(self, function, *args, changes_schedule: bool = True):
+        """Same as submit, waiting for the result. Never call it from a function that is already running on the writer thread.
+        Raises TimeoutError if the write is not committed in time, it may still be committed later"""
+        return self.submit(function, *args, changes_schedule=changes_schedule).result(timeout=WRITE_TIMEOUT_SECONDS)
+
+    def after_commit(self, callback):
+        """Only for functions running on the writer thread. callback(sequence) runs on the writer thread once the write is committed
+        (and never if it is rolled back), in commit order, with the sequence the write got from get_commit_sequence"""
+        if threading.current_thread() is not _writer_thread:
+            raise RuntimeError("after_commit can only be used by a write running on the writer thread")
+        _running_write.after_commit_callbacks.append(callback)
+
+    def get_commit_sequence(self) -> int:
+        """Number of writes committed on the current household that may have changed the scheduled tasks, it grows by one with each of them.
+        A state read from the database after reading the sequence includes at least the writes up to it"""
+        return _commit_sequences_by_household.get(get_current_household().name, 0)
+
+    def _start_writer(self):
+        global _writer_thread
+        if _writer_thread != None:
+            return
+        with _writer_lock:
+            if _writer_thread == None:
+                _writer_thread = threading.Thread(target=_run_writer, name="database-writer", daemon=True)
+                _writer_thread.start()
+
+def _run_writer():
+    while True:
+        # Whatever got queued while the previous transaction was running goes on the next one
+        writes = [_writes.get()]
+        while len(writes) < MAX_WRITES_PER_TRANSACTION:
+            try:
+                writes.append(_writes.get_nowait())
+            except queue.Empty:
+                break
+
+        writes_by_household = {}
+        for write in writes:
+            writes_by_household.setdefault(write.household, []).append(write)
+        for household, household_writes in writes_by_household.items():
+            # The writer must outlive any failure (like a household database that can't be opened), or every later write would wait forever
+            try:
+                with use_household(household):
+                    _run_transaction(open_writer_session(), household_writes)
+            except Exception as error:
+                logger.exception(f"Database writes of household {household.name} failed")
+                _fail_writes(household_writes, error)
+
+def _run_transaction(con, writes: list[_Write]):
+    global _running_write
+    outcomes = []
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        for write in writes:
+            if not write.future.set_running_or_notify_cancel():
+                continue
+            # Each write has its own savepoint, so a failing one doesn't undo the others
+            con.execute("SAVEPOINT write")
+            _running_write = write
+            try:
+                result = write.function(con, *write.args)
+                con.execute("RELEASE write")
+                outcomes.append((write, result, None))
+            except Exception as error:
+                con.execute("ROLLBACK TO write")
+                con.execute("RELEASE write")
+                outcomes.append((write, None, error))
+        con.execute("COMMIT")
+    except Exception as error:
+        logger.exception("Database write transaction failed")
+        try:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+        except Exception:
+            logger.exception("Database write transaction rollback failed")
+        _fail_writes(writes, error)
+        return
+
+    metricsService.observe_write_batch(len(outcomes))
+    household_name = get_current_household().name
+    for write, result, error in outcomes:
+        if error != None:
+            continue
+        sequence = _commit_sequences_by_household.get(household_name, 0)
+        if write.changes_schedule:
+            sequence += 1
+            _commit_sequences_by_household[household_name] = sequence
+        for callback in write.after_commit_callbacks:
+            try:
+                callback(sequence)
+            except Exception:
+                logger.exception("After commit callback failed")
+    for write, result, error in outcomes:
+        if error != None:
+            write.future.set_exception(error)
+        else:
+            write.future.set_result(result)
+
+def _fail_writes(writes: list[_Write], error: Exception):
+    for write in writes:
+        if not write.future.done():
+            write.future.set_exception(error)